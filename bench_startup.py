@@ -0,0 +1,34 @@
+"""
+Startup-time benchmark: time fresh interpreters importing digits
+
+    python bench_startup.py [repeat]
+"""
+import subprocess
+import sys
+import time
+
+
+def startup_time(code, repeat=20):
+    """
+    Return best wall-clock time of running code in a fresh interpreter
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    baseline = startup_time('pass', repeat)
+    for label, code in [
+        ('import digits', 'import digits'),
+        ('import digits, PIL.Image', 'import digits, PIL.Image'),
+    ]:
+        elapsed = startup_time(code, repeat)
+        print(
+            f'{label:28s} {elapsed*1000:7.1f} ms '
+            f'(+{(elapsed - baseline)*1000:.1f} ms over bare interpreter)'
+        )
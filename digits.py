@@ -1,10 +1,22 @@
+import array
+import bisect
 import collections
+import csv
 import functools
+import hashlib
+import heapq
+import io
 import itertools
+import json
+import mmap
+import os
 import pathlib
-from PIL import Image
-import tempfile
+import random
 import stat
+import struct
+import sys
+import tempfile
+import time
 import zipfile
 import warnings
 
@@ -20,6 +32,10 @@ class Token:
 
         occupied[dict]: maps matchstick image to occupations
         lookup_value[dict]: reverse lookup of occupied
+        mask_values[dict]: value of occupied sites as bit mask
+        removals[dict]: values reached by removing one match
+
+    The tables are compiled from a glyph set, see load_glyphs
 
     Below two subclasses are defined:
         Operator (+-=)
@@ -29,6 +45,8 @@ class Token:
     """
     occupied = {}
     lookup_value = {}
+    mask_values = {}
+    removals = {}
 
     def __init__(self, value=None):
         """
@@ -230,33 +248,199 @@ class Digit(Token):
         9: (0, 1, 2, 3, 5, 6),
     }
     lookup_value = {frozenset(v): k for k, v in occupied.items()}
-    removals = {
-        7: {1},
-        8: {0, 6, 9},
-        9: {3, 5},
+
+
+GLYPH_CLASSES = {'digits': Digit, 'operators': Operator}
+GLYPH_SITES = {Digit: 7, Operator: 2}
+GLYPH_VALUES = {Digit: range(10), Operator: ('+', '-', '=')}
+
+
+def glyph_spec() -> dict:
+    """
+    Glyph set installed in the token classes, as read by read_glyph_set
+    """
+    return {
+        kind: {
+            str(value): list(sites) for value, sites in cls.occupied.items()
+        }
+        for kind, cls in GLYPH_CLASSES.items()
     }
 
 
+def glyph_digest() -> int:
+    """
+    Digest of the installed glyph set, 64 bits of its sha1
+    """
+    digest = hashlib.sha1(json.dumps(glyph_spec(), sort_keys=True).encode())
+    return int.from_bytes(digest.digest()[:8], 'little')
+
+
+def read_glyph_set(name='standard', path=None) -> dict:
+    """
+    Read glyph set from a JSON file of named sets, resolving the sets
+    it is based on
+
+    The default path is $MATCHSTICK_GLYPHS, or glyphs.json next to this
+    module. A set maps 'digits' and 'operators' to the occupied sites of
+    each value; a set with a 'base' overrides the glyphs of its base.
+    """
+    if path is None:
+        path = os.environ.get(
+            'MATCHSTICK_GLYPHS',
+            pathlib.Path(__file__).with_name('glyphs.json')
+        )
+    with open(path) as f:
+        sets = json.load(f)
+    chain = []
+    while name is not None:
+        if name not in sets or name in chain:
+            raise ValueError(f'Unknown or cyclic glyph set {name!r} in {path}')
+        chain.append(name)
+        name = sets[name].get('base')
+    spec = {kind: {} for kind in GLYPH_CLASSES}
+    for name in reversed(chain):
+        for kind in GLYPH_CLASSES:
+            spec[kind].update(sets[name].get(kind, {}))
+    return spec
+
+
+def compile_glyphs(spec: dict) -> dict:
+    """
+    Compile a glyph set into the tables of the token classes: occupied
+    sites, mask to value lookup and values reached by removing a match
+
+    Digit values are integers and must be 0-9, since the solver does
+    arithmetic on them; operators must be '+', '-' or '='.
+    """
+    tables = {}
+    for kind, cls in GLYPH_CLASSES.items():
+        occupied = {}
+        for key, sites in spec[kind].items():
+            value = int(key) if cls is Digit and key.isdigit() else key
+            if value not in GLYPH_VALUES[cls]:
+                raise ValueError(f'Unsupported {kind[:-1]} {key!r}')
+            if any(not 0 <= site < GLYPH_SITES[cls] for site in sites):
+                raise ValueError(f'Invalid sites {sites} of {key!r}')
+            occupied[value] = tuple(sorted(set(sites)))
+        masks = {
+            value: sum(1 << site for site in sites)
+            for value, sites in occupied.items()
+        }
+        mask_values = {mask: value for value, mask in masks.items()}
+        if len(mask_values) != len(masks):
+            raise ValueError(f'Glyphs of {kind} are not distinct')
+        removals = {}
+        for value, mask in masks.items():
+            reached = {
+                mask_values[mask & ~(1 << site)]
+                for site in occupied[value]
+                if mask & ~(1 << site) in mask_values
+            }
+            if reached:
+                removals[value] = reached
+        tables[cls] = dict(
+            occupied=occupied,
+            lookup_value={frozenset(v): k for k, v in occupied.items()},
+            mask_values=mask_values,
+            removals=removals,
+        )
+    return tables
+
+
+def _install_glyphs(tables):
+    for cls, attributes in tables.items():
+        for attribute, table in attributes.items():
+            setattr(cls, attribute, table)
+
+
+_install_glyphs(compile_glyphs(glyph_spec()))
+STANDARD_GLYPHS = glyph_digest()
+
+
+def load_glyphs(name='standard', path=None) -> None:
+    """
+    Install a glyph set of the glyph file for solving and rendering
+
+    The compiled tables replace those of the token classes, and cached
+    token moves and move graphs are dropped. Precomputed move tables are
+    only used if they were built for the same glyph set.
+    """
+    use_glyphs(read_glyph_set(name, path))
+
+
+def use_glyphs(spec: dict) -> None:
+    """
+    Install a glyph set given as read by read_glyph_set, see load_glyphs
+    """
+    _install_glyphs(compile_glyphs(spec))
+    SEGMENT_MASKS.clear()
+    SEGMENT_MASKS.update(_segment_masks())
+    token_moves.cache_clear()
+    _move_graphs.clear()
+
+
+TOKEN_TABLE = {
+    **{d: (Digit, d) for d in range(10)},
+    **{str(d): (Digit, d) for d in range(10)},
+    **{op: (Operator, op) for op in Operator.occupied},
+}
+
+
 def token(value):
     try:
-        return Digit(int(value))
-    except ValueError:
-        if value in ('+-='):
-            return Operator(value)
-        else:
-            raise ValueError
+        cls, value = TOKEN_TABLE[value]
+    except KeyError:
+        raise ValueError(f'Invalid token {value!r}') from None
+    return cls(value)
+
+
+def _parse(expr: str) -> tuple:
+    try:
+        return tuple(
+            TOKEN_TABLE[c][1] for c in expr.strip().replace(' ', '')
+        )
+    except KeyError as e:
+        raise ValueError(f'Invalid token {e.args[0]!r} in {expr!r}') from None
+
+
+@functools.lru_cache(maxsize=4096)
+def scan_values(expr: str) -> tuple:
+    """
+    Return token values of expression, parsed by table lookup and
+    cached for repeated expressions
+
+    >>> scan_values('1 + 2 = 3')
+    (1, '+', 2, '=', 3)
+    """
+    return _parse(expr)
+
+
+def tokens_from_values(values: tuple) -> list[Token]:
+    return [TOKEN_TABLE[v][0](v) for v in values]
 
 
 def remove_matches(tokens: list[Token], n: int = 1):
-    generated = set()
-    if n == 1:
-        for i, d in enumerate(tokens):
-            for d_ in d.remove_matches(n):
-                tokens[i] = d_
-                if all(t.value is not None for t in tokens):
-                    generated.add(tuple(d.__class__(d.value) for d in tokens))
-                tokens[i] = d
-    return generated
+    """
+    Input list of tokens representing an expression,
+    generate valid expressions by removing n matches
+    """
+    values = tuple(t.value for t in tokens)
+    return {
+        tuple(tokens_from_values(expr))
+        for expr in neighbourhood(values, n, 0)
+    }
+
+
+def add_matches(tokens: list[Token], n: int = 1):
+    """
+    Input list of tokens representing an expression,
+    generate valid expressions by adding n matches
+    """
+    values = tuple(t.value for t in tokens)
+    return {
+        tuple(tokens_from_values(expr))
+        for expr in neighbourhood(values, 0, n)
+    }
 
 
 def move_matches(tokens: list[Token], n: int = 1):
@@ -271,342 +455,2652 @@ def move_matches(tokens: list[Token], n: int = 1):
     virtual = [(j, v) for j, t in enumerate(tokens) for v in t.get_virtual()]
     generated = set()
 
+    # number of invalid tokens, updated only at replaced positions
+    invalid = sum(t.value is None for t in tokens)
+
+    def replace(i, new):
+        nonlocal invalid
+        old = tokens[i]
+        invalid += (new.value is None) - (old.value is None)
+        tokens[i] = new
+        return old
+
     if n == 1:
         for (i, occ), in itertools.combinations(occupied, r=1):
             hole = tokens[i].__class__.from_occupied(
                 set(tokens[i].get_occupied()) - {occ}
             )
-            tokens[i], ti = hole, tokens[i]
+            ti = replace(i, hole)
             for (j, vir), in itertools.combinations(virtual, r=1):
                 particle = tokens[j].__class__.from_occupied(
                     set(tokens[j].get_occupied()) | {vir}
                 )
-                tokens[j], tj = particle, tokens[j]
-                if all(t.value is not None for t in tokens):
+                tj = replace(j, particle)
+                if not invalid:
                     generated.add(tuple(t.copy() for t in tokens))
-                tokens[j] = tj
-            tokens[i] = ti
+                replace(j, tj)
+            replace(i, ti)
 
     if n == 2:
         for (i1, occ1), (i2, occ2) in itertools.combinations(occupied, r=2):
             hole1 = tokens[i1].__class__.from_occupied(
                 set(tokens[i1].get_occupied()) - {occ1}
             )
-            tokens[i1], ti1 = hole1, tokens[i1]
+            ti1 = replace(i1, hole1)
 
             hole2 = tokens[i2].__class__.from_occupied(
                 set(tokens[i2].get_occupied()) - {occ2}
             )
-            tokens[i2], ti2 = hole2, tokens[i2]
+            ti2 = replace(i2, hole2)
 
             for (j1, vir1), (j2, vir2) in itertools.combinations(virtual, r=2):
 
                 particle1 = tokens[j1].__class__.from_occupied(
                     set(tokens[j1].get_occupied()) | {vir1}
                 )
-                tokens[j1], tj1 = particle1, tokens[j1]
+                tj1 = replace(j1, particle1)
 
                 particle2 = tokens[j2].__class__.from_occupied(
                     set(tokens[j2].get_occupied()) | {vir2}
                 )
-                tokens[j2], tj2 = particle2, tokens[j2]
+                tj2 = replace(j2, particle2)
 
-                if all(d.value is not None for d in tokens):
+                if not invalid:
                     generated.add(
                         tuple(d.copy() for d in tokens)
                     )
-                tokens[j2] = tj2
-                tokens[j1] = tj1
+                replace(j2, tj2)
+                replace(j1, tj1)
 
-            tokens[i2] = ti2
-            tokens[i1] = ti1
+            replace(i2, ti2)
+            replace(i1, ti1)
     if n > 2:
         raise NotImplementedError
 
     return generated
 
 
-def scan(expr):
-    expr = expr.strip().replace(' ', '')
-    tokens = [token(c) for c in expr]
-    return tokens
+def token_class(value):
+    return Digit if isinstance(value, int) else Operator
 
 
-def valid_equations(n):
-    eqs = set()
-    if n == 2:
-        for n in range(10):
-            eqs.add(f'{n} = {n}')
-    if n == 3:
-        for i in range(10):
-            for j in range(10-i):
-                eqs.add(f'{i} + {j} = {i+j}')
-                eqs.add(f'{i} = {i+j} - {j}')
-                eqs.add(f'{i+j} = {i} + {j}')
-                eqs.add(f'{i+j} - {j} = {i}')
-    if n == 4:
-        for i in range(10):
-            for j in range(10):
-                for k in range(10):
-                    for _l in range(10):
-                        if i + j == k + _l:
-                            eqs.add(f'{i} + {j} = {k} + {_l}')
-                        if i - j == k + _l:
-                            eqs.add(f'{i} - {j} = {k} + {_l}')
-                        if i + j == k - _l:
-                            eqs.add(f'{i} + {j} = {k} - {_l}')
-                        if i - j == k - _l:
-                            eqs.add(f'{i} - {j} = {k} - {_l}')
-                        if i + j + k == _l:
-                            eqs.add(f'{i} + {j} + {k} = {_l}')
-                            eqs.add(f'{_l} = {i} + {j} + {k}')
-                        if i - j + k == _l:
-                            eqs.add(f'{i} - {j} + {k} = {_l}')
-                            eqs.add(f'{_l} = {i} - {j} + {k}')
-                        if i + j - k == _l:
-                            eqs.add(f'{i} + {j} - {k} = {_l}')
-                            eqs.add(f'{_l} = {i} + {j} - {k}')
-                        if i - j - k == _l:
-                            eqs.add(f'{i} - {j} - {k} = {_l}')
-                            eqs.add(f'{_l} = {i} - {j} - {k}')
+@functools.lru_cache(maxsize=None)
+def token_moves(cls, value) -> dict[tuple[int, int], tuple]:
+    """
+    One-token move graph: map numbers of (removed, added) matches to the
+    values reachable from a token value
 
-    return eqs
+    Read from the precomputed tables if loaded, see load_tables
+
+    >>> token_moves(Digit, 8)[1, 0]
+    (0, 6, 9)
+    """
+    tables = get_tables()
+    if tables is not None:
+        return tables.token_moves(value)
+    return _compute_token_moves(cls, value)
 
 
-def map_solutions(n: int, m: int = 1) -> dict[str, set[str]]:
+def _compute_token_moves(cls, value):
+    mask = SEGMENT_MASKS[value]
+    moves = collections.defaultdict(list)
+    for other_mask, other in cls.mask_values.items():
+        removed = (mask & ~other_mask).bit_count()
+        added = (other_mask & ~mask).bit_count()
+        moves[removed, added].append(other)
+    return {k: tuple(v) for k, v in moves.items()}
+
+
+def evaluate(values: tuple) -> tuple[int, int]:
     """
-    Given number of digits and number of moves return mapping of
-    riddle to set of possible solutions
+    Return number of '=' and balance, left minus right hand side,
+    of an expression given as token values
 
-    >>> map_solutions(2):
-    {"2 = 3": {"2 = 2", "3 = 3"}, ...}
+    The expression is a true equation if there is one '=' and the
+    balance is zero
+
+    >>> evaluate((1, '+', 7, '=', 8))
+    (1, 0)
     """
-    eqs = valid_equations(n)
-    solutions = collections.defaultdict(set)
-    for eq in eqs:
-        tokens = scan(eq)
-        riddles = move_matches(tokens, m)
-        for r in riddles:
-            key = " ".join(str(token) for token in r)
-            if is_trivial(key):
+    equals, balance, side, sign = 0, 0, 1, 1
+    for value in values:
+        if value == '=':
+            equals += 1
+            side, sign = -1, 1
+        elif value == '+':
+            sign = 1
+        elif value == '-':
+            sign = -1
+        else:
+            balance += side * sign * value
+    return equals, balance
+
+
+def coefficients(values: tuple) -> tuple[int, ...]:
+    """
+    Return the sign each digit contributes to the balance with,
+    zero for operators
+
+    >>> coefficients((1, '+', 7, '=', 8))
+    (1, 0, 1, 0, -1)
+    """
+    coefs, side, sign = [], 1, 1
+    for value in values:
+        if value == '=':
+            side, sign = -1, 1
+        elif value == '+':
+            sign = 1
+        elif value == '-':
+            sign = -1
+        coefs.append(0 if isinstance(value, str) else side * sign)
+    return tuple(coefs)
+
+
+def _extend(layers, position_values, max_removed, max_added, keep=None):
+    """
+    Extend prefixes, keyed by numbers of (removed, added) matches, with
+    the per-token moves of the next positions
+    """
+    for value in position_values:
+        table = token_moves(token_class(value), value)
+        extended = collections.defaultdict(list)
+        for (removed, added), prefixes in layers.items():
+            for (r, a), targets in table.items():
+                if removed + r > max_removed or added + a > max_added:
+                    continue
+                extended[removed + r, added + a].extend(
+                    prefix + (target,)
+                    for prefix in prefixes
+                    for target in targets
+                    if keep is None or keep(prefix + (target,))
+                )
+        layers = extended
+    return layers
+
+
+def _compose(values: tuple, keys, single_equals: bool = False):
+    """
+    Compose per-token move graphs over the positions of an expression
+    into the expressions reached by the given numbers of (removed, added)
+    matches
+
+    Operator positions are composed first, so that operator layouts
+    without exactly one '=' are pruned (single_equals) before they are
+    combined with the digit moves. The balance of each combination is
+    the balance of its operator layout updated by the deltas of the
+    changed digits only.
+
+    Returns lists of (expression, balance) keyed by numbers of
+    (removed, added) matches.
+    """
+    operators = [i for i, v in enumerate(values) if isinstance(v, str)]
+    digits = [i for i, v in enumerate(values) if not isinstance(v, str)]
+    keep = (lambda prefix: prefix.count('=') <= 1) if single_equals else None
+
+    keys = set(keys)
+    max_removed = max(r for r, _ in keys)
+    max_added = max(a for _, a in keys)
+    layouts = _extend(
+        {(0, 0): [()]}, [values[i] for i in operators],
+        max_removed, max_added, keep
+    )
+    digit_moves = _extend(
+        {(0, 0): [()]}, [values[i] for i in digits], max_removed, max_added
+    )
+
+    composed = collections.defaultdict(list)
+    for (r0, a0), prefixes in layouts.items():
+        for layout in prefixes:
+            if single_equals and layout.count('=') != 1:
                 continue
-            if collections.Counter(key)['='] == 1:
-                solutions[key].add(eq)
-    return solutions
+            expr = list(values)
+            for i, op in zip(operators, layout):
+                expr[i] = op
+            coefs = coefficients(expr)
+            positions = [
+                (k, i, coefs[i], values[i]) for k, i in enumerate(digits)
+            ]
+            balance = evaluate(expr)[1]
+            for (r1, a1), digit_prefixes in digit_moves.items():
+                if (r0 + r1, a0 + a1) not in keys:
+                    continue
+                target = composed[r0 + r1, a0 + a1]
+                for digit_values in digit_prefixes:
+                    bal = balance
+                    for k, i, coef, value in positions:
+                        d = expr[i] = digit_values[k]
+                        if d != value:
+                            bal += coef * (d - value)
+                    target.append((tuple(expr), bal))
+    return composed
+
+
+PUZZLE_KINDS = {
+    # matches (removed, added) per move, from solution to riddle
+    'move': (1, 1),
+    'add': (1, 0),
+    'remove': (0, 1),
+}
+
+
+def move_neighbourhoods(
+    values: tuple, max_moves: int = 1, truth=None, kind: str = 'move'
+) -> dict:
+    """
+    Return the exact m-move neighbourhoods, m = 1..max_moves, of an
+    expression given as a tuple of token values
+
+    Moving m matches removes m occupied and adds m vacant sites, which is
+    distributed over positions as per-token (removed, added) transitions.
+    The one-token move graphs are composed position by position, keeping
+    prefixes per running (removed, added) count, so all m share the work.
+    Every position keeps its token class, so operators never move to the
+    ends of the expression.
+
+    kind: 'move' (m removed and m added), 'add' (m removed) or
+    'remove' (m added) matches, see PUZZLE_KINDS: the riddles of an
+    add-matches puzzle are its solutions with matches removed.
+
+    truth: if given, keep only expressions with a single '=' that are
+    true (equations) or false (riddles). Operator layouts with another
+    number of '=' are pruned before digits are expanded, and balances are
+    updated by deltas of the changed digits.
+
+    >>> move_neighbourhoods((2, '=', 3), truth=True)[1]
+    {(2, '=', 2), (3, '=', 3)}
+    """
+    removed, added = PUZZLE_KINDS[kind]
+    keys = {m: (m*removed, m*added) for m in range(1, max_moves + 1)}
+    layers = _compose(
+        values, keys.values(), single_equals=truth is not None
+    )
+    return {
+        m: {
+            expr for expr, balance in layers.get(key, ())
+            if truth is None or (balance == 0) is truth
+        }
+        for m, key in keys.items()
+    }
 
 
-def generate_image(expr):
-    expr = expr.strip().replace(' ', '')
-    image_dir = pathlib.Path('img')
-    images = [Image.open(image_dir/f'm{c}.jpg') for c in expr]
-    images = [crop(image) for image in images]
-    hsize = sum(image.size[0] for image in images)
-    vsize = max(image.size[1] for image in images)
-    mode = images[0].mode
-    joined_image = Image.new(mode, (hsize, vsize))
-    offset = 0
-    for image in images:
-        joined_image.paste(image, (offset, 0))
-        offset += image.size[0]
-    return joined_image
+def neighbourhood(values: tuple, removed: int, added: int) -> set[tuple]:
+    """
+    Return valid expressions reached by removing and adding the given
+    numbers of matches
 
+    >>> neighbourhood((6, '+', 7), 1, 0)
+    {(5, '+', 7), (6, '-', 7), (6, '+', 1)}
+    """
+    key = removed, added
+    return {expr for expr, _ in _compose(values, [key]).get(key, ())}
 
-def crop(img, keep=300):
-    width, height = img.size
-    left = width//2 - keep//2
-    right = width//2 + keep//2
-    dim = (left, 0, right, height)
-    imgc = img.crop(dim)
-    return imgc
 
+def expr_values(expr: str) -> tuple:
+    return scan_values(expr)
 
-def img_filename(eq):
-    eq = eq.strip().replace(' ', '')
-    filename = f'{eq}.png'
-    return filename
 
+def expr_string(values: tuple) -> str:
+    return " ".join(str(v) for v in values)
 
-def is_trivial(expr):
-    return eval(expr.replace('=', '==')) is True
 
+class Progress:
+    """
+    Throttled report of items processed, rate and estimated time left
 
-def create_zip_with_symlink(output_zip_filename, link_source, link_target):
+    Reports are written on one line of stderr, at most every interval
+    seconds, and only if enabled
 
-    with zipfile.ZipFile(
-        output_zip_filename, 'w', compression=zipfile.ZIP_DEFLATED
-    ) as zip_out:
-        write_symlink_to_zip(zip_out, link_source, link_target)
+    >>> with Progress(len(eqs), 'equations') as progress:
+    ...     for eq in eqs:
+    ...         progress.update()
+    """
+    def __init__(
+        self, total=None, label='', enabled=True, interval=0.5, stream=None
+    ):
+        self.total = total
+        self.label = label
+        self.enabled = enabled
+        self.interval = interval
+        self.stream = stream if stream is not None else sys.stderr
+        self.done = 0
+        self.start = self.last = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, n=1):
+        self.done += n
+        if self.enabled:
+            now = time.perf_counter()
+            if now - self.last >= self.interval:
+                self.last = now
+                self.report()
+
+    def report(self, end=''):
+        elapsed = time.perf_counter() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        status = f'{self.label}: {self.done}'
+        if self.total:
+            status += f'/{self.total} ({100*self.done/self.total:.0f}%)'
+        status += f' {rate:.0f}/s'
+        if self.total and rate > 0:
+            eta = int((self.total - self.done) / rate)
+            status += f' ETA {eta//60:d}:{eta%60:02d}'
+        self.stream.write(f'\r{status}\x1b[K{end}')
+        self.stream.flush()
+
+    def close(self):
+        if self.enabled:
+            self.report(end='\n')
+
+
+TOKEN_CODES = {**{d: d for d in range(10)}, '+': 10, '-': 11, '=': 12}
+CODE_TOKENS = {code: value for value, code in TOKEN_CODES.items()}
+
+
+def encode(values: tuple) -> int:
+    """
+    Encode expression values as an integer, base 13 after a leading 1
 
+    >>> encode((2, '=', 3))
+    2694
+    """
+    code = 1
+    for value in values:
+        code = code * 13 + TOKEN_CODES[value]
+    return code
 
-def write_symlink_to_zip(zip_out, link_source, link_target):
-    zip_info = zipfile.ZipInfo(link_source)
-    zip_info.create_system = 3
 
-    unix_st_mode = (
-        stat.S_IFLNK | stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR |
-        stat.S_IRGRP | stat.S_IWGRP | stat.S_IXGRP | stat.S_IROTH |
-        stat.S_IWOTH | stat.S_IXOTH
-    )
+def decode(code: int) -> tuple:
+    """
+    Decode integer to expression values
 
-    zip_info.external_attr = unix_st_mode << 16
-    zip_out.writestr(zip_info, link_target)
+    >>> decode(2694)
+    (2, '=', 3)
+    """
+    values = []
+    while code > 1:
+        code, value = divmod(code, 13)
+        values.append(CODE_TOKENS[value])
+    return tuple(reversed(values))
 
 
-def zip_equalities(zip_file, equalities, path=None):
-    zip_file = pathlib.Path(zip_file)
-    if path is None:
-        path = zip_file.stem
-    with zipfile.ZipFile(zip_file, 'w') as zp:
-        for eq in equalities:
-            print(eq)
-            img = generate_image(eq)
-            filename = img_filename(eq)
-            with tempfile.TemporaryDirectory() as td:
-                tmp = pathlib.Path(td)
-                img.save(tmp / filename)
-                zp.write(
-                    str(tmp/filename),
-                    arcname=f'{path}/{filename}'
-                )
-        print(f'-> {zip_file}')
+_move_graphs = {}
 
 
-def zip_solutions(zip_file, mapping, path=None):
-    zip_file = pathlib.Path(zip_file)
-    if path is None:
-        path = zip_file.stem
-    equalities = functools.reduce(
-        lambda x, y: x | y,
-        (m[1] for m in mapping)
-    )
-    zip_equalities(zip_file, equalities, path=f'{path}/equalities')
-    with zipfile.ZipFile(zip_file, 'a') as zp:
-        with tempfile.TemporaryDirectory() as td:
-            tmp = pathlib.Path(td)
-            for riddle, solutions in mapping:
-                print(f'{riddle}:\t', "\t".join(solutions))
-                img_riddle = generate_image(riddle)
-                img_riddle_filename = pathlib.Path(img_filename(riddle))
-                riddle_dir = img_riddle_filename.stem
-                img_riddle.save(tmp / img_riddle_filename)
-                zp.write(
-                    tmp/img_riddle_filename,
-                    arcname=f'{path}/{len(solutions)}-solution-puzzles/{riddle_dir}/{img_riddle_filename}'
+def move_graph(
+    n: int, m: int = 1, progress: bool = False, kind: str = 'move'
+) -> dict[str, frozenset[str]]:
+    """
+    Return graph of valid equations with n digits to the riddles,
+    expressions with a single '=' that are false, reached by moving
+    exactly m matches (or removing/adding them, see PUZZLE_KINDS)
+
+    The graphs of all move counts up to m are built in the same pass
+    and memoised, so a family of 1, 2, 3-move graphs costs about as much
+    as the 3-move graph alone.
+    """
+    tables = get_tables()
+    if (n, m, kind) not in _move_graphs and tables is not None:
+        if kind == 'move' and tables.has_graph(n, m):
+            _move_graphs[n, m, kind] = tables.graph(n, m)
+    if (n, m, kind) not in _move_graphs:
+        graphs = {k: {} for k in range(1, m + 1)}
+        equations = equation_list(n)
+        with Progress(len(equations), 'equations', progress) as report:
+            for eq, values in zip(equations, equation_values(n)):
+                neighbourhoods = move_neighbourhoods(
+                    values, m, truth=False, kind=kind
                 )
-                for solution in solutions:
-                    img_solution_filename = img_filename(solution)
-                    link = (
-                        f'{path}/{len(solutions)}-solution-puzzles/{riddle_dir}/solutions/'
-                        f'{img_solution_filename}'
+                for k, neighbours in neighbourhoods.items():
+                    graphs[k][eq] = frozenset(
+                        expr_string(v) for v in neighbours
                     )
-                    target = f'../../../equalities/{img_solution_filename}'
-                    print(f'ln -s {target} {link}')
-                    write_symlink_to_zip(zp, link, target)
-        print(f'-> {zip_file}')
+                report.update()
+        for k, graph in graphs.items():
+            _move_graphs.setdefault((n, k, kind), graph)
+    return _move_graphs[n, m, kind]
 
 
-if __name__ == "__main__":
+TABLES_MAGIC = b'MTCH'
+TABLES_VERSION = 1
+TABLES_HEADER = struct.Struct('<4sII')
+TABLES_SECTION = struct.Struct('<4sIIQQQ')
 
-    import argparse
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        '--single-moves', action='store_true',
-        help='List valid single replacements of expression'
-    )
-    parser.add_argument(
-        '--double-moves', action='store_true',
-        help='List valid double replacements of expression'
-    )
-    parser.add_argument(
-        '--triple-moves', action='store_true',
-        help='List valid triple replacements of expression'
-    )
-    parser.add_argument(
-        '--list-equalities', action='store_true',
-        help='List equalities of given dimension'
-    )
-    parser.add_argument(
-        '--zip-equalities', action='store_true',
-        help='Save equality images of given dimension as zip'
-    )
-    parser.add_argument(
-        '--number-of-digits', default=2, type=int,
-        help='Number of digits in expression'
-    )
-    parser.add_argument(
-        '--number-of-moves', default=1, type=int,
-        help='Number of matches moved'
-    )
+def _token_table_key(value, removed, added):
+    return TOKEN_CODES[value] << 6 | removed << 3 | added
 
-    parser.add_argument(
-        '--map-solutions', action='store_true',
-        help='Map riddle to solutions'
-    )
-    parser.add_argument(
-        '--zip-solutions', action='store_true',
-        help='Save riddle/solution images in zip file'
-    )
 
-    parser.add_argument(
-        '--matchstick-image', action='store_true',
-        help='Display matchstick image of expression'
+def table_sections(digits=(2, 3, 4), moves=(1,), equations=()):
+    """
+    Sections of the move tables: per-token moves, the glyph set, move
+    graphs of the given numbers of digits and moves, and the equation
+    lists of the given numbers of digits
+
+    Everything is computed from scratch, never read from loaded tables,
+    so that rebuilding the tables picks up changes of the move engine.
+    """
+    global _tables
+    loaded, _tables = _tables, None
+    token_moves.cache_clear()
+    try:
+        return _table_sections(digits, moves, equations)
+    finally:
+        _tables = loaded
+        token_moves.cache_clear()
+
+
+def _table_sections(digits, moves, equations):
+    sections = []
+
+    keys, targets = [], []
+    for value, code in sorted(TOKEN_CODES.items(), key=lambda x: x[1]):
+        table = _compute_token_moves(token_class(value), value)
+        for (removed, added), values in sorted(table.items()):
+            keys.append(_token_table_key(value, removed, added))
+            targets.append([TOKEN_CODES[v] for v in values])
+    sections.append((b'TOKN', 0, 0, keys, targets))
+    sections.append((b'GLPH', 0, 0, [glyph_digest()], [[]]))
+
+    for n in digits if moves else ():
+        neighbourhoods = {
+            encode(values): move_neighbourhoods(
+                values, max(moves), truth=False
+            )
+            for values in map(_parse, equation_list(n))
+        }
+        nodes = sorted(neighbourhoods)
+        for m in moves:
+            edges = [
+                sorted({encode(v) for v in neighbourhoods[k].get(m, ())})
+                for k in nodes
+            ]
+            sections.append((b'MOVE', n, m, nodes, edges))
+
+    for n in equations:
+        # in equation_list order, so that ids index the nodes
+        nodes = [encode(_parse(eq)) for eq in equation_list(n)]
+        sections.append((b'EQNS', n, 0, nodes, [[] for _ in nodes]))
+    return sections
+
+
+def pack_tables(sections) -> bytes:
+    """
+    Pack table sections into the binary layout read by MoveTables
+
+    Every section is an array of uint64 node keys, an index array into
+    the uint64 edge array, and the edge array, as for a sparse matrix in
+    compressed row format.
+    """
+    offset = TABLES_HEADER.size + TABLES_SECTION.size * len(sections)
+    directory, blobs = [], []
+    for kind, n, m, nodes, edges in sections:
+        indptr = array.array('Q', [0])
+        for targets in edges:
+            indptr.append(indptr[-1] + len(targets))
+        blob = (
+            array.array('Q', nodes).tobytes()
+            + indptr.tobytes()
+            + array.array('Q', itertools.chain(*edges)).tobytes()
+        )
+        directory.append(
+            TABLES_SECTION.pack(kind, n, m, offset, len(nodes), indptr[-1])
+        )
+        blobs.append(blob)
+        offset += len(blob)
+    return b''.join(
+        [TABLES_HEADER.pack(TABLES_MAGIC, TABLES_VERSION, len(sections))]
+        + directory + blobs
     )
 
-    args = parser.parse_args()
 
-    if args.list_equalities:
-        for eq in valid_equations(args.number_of_digits):
-            print(eq)
-    if args.zip_equalities:
-        equations = valid_equations(args.number_of_digits)
-        zip_file = f'equalities-{args.number_of_digits}.zip'
-        zip_equalities(zip_file, equations)
+def build_tables(path, digits=(2, 3, 4), moves=(1,)):
+    """
+    Precompute per-token move tables and the move graphs of equations
+    with the given numbers of digits into a binary file
 
-    if args.map_solutions:
-        mapping = map_solutions(args.number_of_digits, args.number_of_moves)
-        mapping = sorted(mapping.items(), key=lambda x: (len(x[1]), x))
-        for riddle, solutions in mapping:
-            print(f'{riddle}:\t', "\t".join(solutions))
+    Nodes and edges of the graphs are sorted encoded expressions, see
+    encode and pack_tables. The file is replaced only once the tables
+    are complete, so that loaded tables stay valid meanwhile.
+    """
+    path = pathlib.Path(path)
+    data = pack_tables(table_sections(digits, moves))
+    partial = path.with_name(f'.{path.name}.tmp')
+    with open(partial, 'wb') as f:
+        f.write(data)
+    os.replace(partial, path)
 
-    if args.zip_solutions:
-        zip_file = (
-            f'{args.number_of_digits}-digit-{args.number_of_moves}-move-puzzles.zip'
-        )
 
-        equations = valid_equations(args.number_of_digits)
-        zip_equalities(zip_file, equations)
+class MoveTables:
+    """
+    Read-only view of a file written by build_tables, or of a buffer
+    holding packed tables such as a shared memory block
 
-        mapping = map_solutions(args.number_of_digits, args.number_of_moves)
-        mapping = sorted(mapping.items(), key=lambda x: (len(x[1]), x))
-        zip_solutions(zip_file, mapping)
+    The file is memory-mapped, so processes on one host share its pages
+    """
+    def __init__(self, path=None, buffer=None):
+        if sys.byteorder != 'little':
+            raise ValueError('Move tables require a little-endian host')
+        self._mmap = None
+        if buffer is None:
+            with open(path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer = self._mmap
+        magic, version, count = TABLES_HEADER.unpack_from(buffer)
+        if magic != TABLES_MAGIC or version != TABLES_VERSION:
+            raise ValueError(
+                f'{path or "buffer"} is not a version {TABLES_VERSION} '
+                'move table'
+            )
+        view = memoryview(buffer)
+        self.sections = {}
+        for i in range(count):
+            kind, n, m, offset, nodes, edges = TABLES_SECTION.unpack_from(
+                buffer, TABLES_HEADER.size + i * TABLES_SECTION.size
+            )
+            start = offset
+            arrays = []
+            for size in (nodes, nodes + 1, edges):
+                arrays.append(view[start:start + 8*size].cast('Q'))
+                start += 8*size
+            self.sections[kind, n, m] = tuple(arrays)
+
+    def _targets(self, section, key):
+        nodes, indptr, edges = section
+        i = bisect.bisect_left(nodes, key)
+        if i == len(nodes) or nodes[i] != key:
+            return None
+        return edges[indptr[i]:indptr[i + 1]]
+
+    def token_moves(self, value) -> dict[tuple[int, int], tuple]:
+        section = self.sections[b'TOKN', 0, 0]
+        moves = {}
+        for removed in range(8):
+            for added in range(8):
+                key = _token_table_key(value, removed, added)
+                targets = self._targets(section, key)
+                if targets is not None:
+                    moves[removed, added] = tuple(
+                        CODE_TOKENS[t] for t in targets
+                    )
+        return moves
 
-    if args.single_moves:
-        print("Move one matchstick in expression")
-        while expr := input("Expression: "):
-            tokens = scan(expr)
-            moves = move_matches(tokens, n=1)
-            print("Valid moves")
-            for m in moves:
-                print(" ".join(str(t) for t in m))
+    @property
+    def glyphs(self):
+        """
+        Digest of the glyph set the tables were built for, None if the
+        tables predate glyph sets (standard glyphs)
+        """
+        if (b'GLPH', 0, 0) not in self.sections:
+            return None
+        return self.sections[b'GLPH', 0, 0][0][0]
 
-    if args.double_moves:
-        print("Move two matchsticks in expression")
-        while expr := input("Expression: "):
-            tokens = scan(expr)
-            moves = move_matches(tokens, n=2)
-            print("Valid moves")
-            for m in moves:
-                print(" ".join(str(t) for t in m))
+    def has_graph(self, n, m) -> bool:
+        return (b'MOVE', n, m) in self.sections
 
-    if args.triple_moves:
-        print("Move three matchsticks in expression")
-        while expr := input("Expression: "):
-            tokens = scan(expr)
-            moves = move_matches(tokens, n=3)
-            print("Valid moves")
-            for m in moves:
-                print(" ".join(str(t) for t in m))
+    def graph(self, n, m) -> dict[str, frozenset[str]]:
+        nodes, indptr, edges = self.sections[b'MOVE', n, m]
+        strings = {}
+
+        def string(code):
+            if code not in strings:
+                strings[code] = expr_string(decode(code))
+            return strings[code]
+
+        return {
+            string(node): frozenset(
+                string(edge) for edge in edges[indptr[i]:indptr[i + 1]]
+            )
+            for i, node in enumerate(nodes)
+        }
+
+    def has_equations(self, n) -> bool:
+        return (b'EQNS', n, 0) in self.sections
+
+    def equations(self, n) -> tuple[tuple, ...]:
+        """
+        Token values of equation_list(n), in the same order
+        """
+        nodes, _, _ = self.sections[b'EQNS', n, 0]
+        return tuple(decode(code) for code in nodes)
+
+    def close(self):
+        for section in self.sections.values():
+            for view in section:
+                view.release()
+        self.sections.clear()
+        if self._mmap is not None:
+            self._mmap.close()
+
+
+_tables = ...
+
+
+def load_tables(path=None):
+    """
+    Memory-map precomputed move tables and use them instead of computing
+    token moves and move graphs
+
+    The default path is $MATCHSTICK_TABLES, or digits.tables next to
+    this module; without a file, or with an empty or invalid one, the
+    tables are computed as needed.
+    """
+    global _tables
+    if path is None:
+        path = os.environ.get(
+            'MATCHSTICK_TABLES',
+            pathlib.Path(__file__).with_name('digits.tables')
+        )
+    path = pathlib.Path(path)
+    try:
+        _tables = MoveTables(path)
+    except (FileNotFoundError, ValueError, struct.error):
+        _tables = None
+    token_moves.cache_clear()
+    _move_graphs.clear()
+    return _tables
+
+
+def get_tables():
+    """
+    Return loaded move tables if they fit the installed glyph set
+    """
+    if _tables is ...:
+        load_tables()
+    if _tables is not None:
+        digest = glyph_digest()
+        if (_tables.glyphs or STANDARD_GLYPHS) != digest:
+            return None
+    return _tables
+
+
+def scan(expr):
+    return tokens_from_values(scan_values(expr))
+
+
+def balanced_digits(coefs: tuple, balance: int = 0):
+    """
+    Yield single-digit tuples d for which balance + sum(c*d) is zero,
+    given coefficients c of +1 or -1
+
+    Digits are chosen depth first as long as the remaining digits can
+    still cancel the balance, and the last digit is solved for.
+
+    >>> list(balanced_digits((1, -1, -1), 7))
+    [(0, 0, 7), (0, 1, 6), ...]
+    """
+    *free, last = coefs
+    reach = [(0, 0)]
+    for c in reversed(free[1:] + [last]):
+        low, high = reach[0]
+        reach.insert(0, (low + min(0, 9*c), high + max(0, 9*c)))
+
+    def solve(k, balance):
+        if k == len(free):
+            d = -balance * last
+            if 0 <= d <= 9:
+                yield (d,)
+            return
+        low, high = reach[k]
+        for d in range(10):
+            b = balance + free[k] * d
+            if low <= -b <= high:
+                for tail in solve(k + 1, b):
+                    yield (d,) + tail
+
+    yield from solve(0, balance)
+
+
+def valid_equations(n, operators='+-'):
+    """
+    Return true equations of n single digits, with one '=' and
+    n - 2 operators from the allowed ones
+
+    Every operator layout fixes the sign each digit contributes with,
+    and the digits balancing the equation are found by balanced_digits
+    instead of trying all 10**n combinations.
+
+    >>> sorted(valid_equations(3, '+'))[:2]
+    ['0 + 0 = 0', '0 + 1 = 1']
+    """
+    if not set(operators) <= {'+', '-'}:
+        raise ValueError(
+            f'Unsupported operators {operators!r}, allowed are + and -'
+        )
+    eqs = set()
+    if n < 2:
+        return eqs
+    for ops in itertools.product(operators, repeat=n - 2):
+        for k in range(n - 1):
+            layout = ops[:k] + ('=',) + ops[k:]
+            values = (0,) + tuple(v for op in layout for v in (op, 0))
+            coefs = coefficients(values)[::2]
+            template = " ".join(('{}',) + tuple(f'{op} {{}}' for op in layout))
+            eqs.update(
+                template.format(*digits) for digits in balanced_digits(coefs)
+            )
+    return eqs
+
+
+def count_solutions(
+    n: int, m: int = 1, progress: bool = False, kind: str = 'move'
+) -> collections.Counter:
+    """
+    Return histogram of number of solutions to number of riddles
+
+    Riddles are streamed from each equation's neighbourhood into a counter
+    keyed by encoded riddle, without building the mapping of riddles to
+    solution sets.
+
+    >>> count_solutions(2)
+    Counter({2: 12, 1: 2})
+    """
+    counts = collections.Counter()
+    equations = equation_list(n)
+    with Progress(len(equations), 'equations', progress) as report:
+        for values in equation_values(n):
+            for riddle in move_neighbourhoods(
+                values, m, truth=False, kind=kind
+            )[m]:
+                counts[encode(riddle)] += 1
+            report.update()
+    return collections.Counter(counts.values())
+
+
+def iter_spilled_solutions(
+    n: int, m: int = 1, memory_budget: int = 1_000_000,
+    progress: bool = False, kind: str = 'move'
+):
+    """
+    Yield riddles and their solutions in riddle order, holding at most
+    memory_budget (riddle, solution) pairs in memory
+
+    When the budget is exceeded the pairs are sorted and spilled to a
+    temporary file; the sorted runs are merged at the end.
+    """
+    with tempfile.TemporaryDirectory() as td:
+        runs = []
+        pairs = []
+
+        def spill():
+            run = pathlib.Path(td) / f'run-{len(runs)}.txt'
+            pairs.sort()
+            with open(run, 'w') as f:
+                f.writelines(f'{riddle}\t{eq}\n' for riddle, eq in pairs)
+            runs.append(run)
+            pairs.clear()
+
+        equations = equation_list(n)
+        with Progress(len(equations), 'equations', progress) as report:
+            for eq, values in zip(equations, equation_values(n)):
+                for riddle in move_neighbourhoods(
+                    values, m, truth=False, kind=kind
+                )[m]:
+                    pairs.append((expr_string(riddle), eq))
+                if len(pairs) >= memory_budget:
+                    spill()
+                report.update()
+
+        if runs:
+            spill()
+            files = [open(run) for run in runs]
+            try:
+                merged = heapq.merge(
+                    *(
+                        (tuple(line.rstrip('\n').split('\t')) for line in f)
+                        for f in files
+                    )
+                )
+                for riddle, group in itertools.groupby(merged, lambda p: p[0]):
+                    yield riddle, {eq for _, eq in group}
+            finally:
+                for f in files:
+                    f.close()
+        else:
+            pairs.sort()
+            for riddle, group in itertools.groupby(pairs, lambda p: p[0]):
+                yield riddle, {eq for _, eq in group}
+
+
+def match_count(values: tuple) -> int:
+    """
+    Number of matches of an expression given as token values
+
+    >>> match_count((1, '+', 7, '=', 8))
+    14
+    """
+    return sum(SEGMENT_MASKS[value].bit_count() for value in values)
+
+
+def iter_solutions(
+    n: int, m: int = 1, progress: bool = False, kind: str = 'move',
+    moves: bool = False
+):
+    """
+    Yield riddles and their solutions as soon as they are final
+
+    moves: yield solutions as a mapping of solution to its packed move
+    descriptors instead of a set, see move_descriptors and pack_moves
+
+    Moving matches keeps their total, and adding or removing m matches
+    changes it by m, so the riddles of equations with a given number of
+    matches only have solutions among those equations. The equations
+    are partitioned by number of matches and the riddles of each
+    partition are yielded, in riddle order, when it is solved; only one
+    partition is held in memory.
+    """
+    partitions = collections.defaultdict(list)
+    for eq_id, values in enumerate(equation_values(n)):
+        partitions[match_count(values)].append(eq_id)
+    equations = equation_list(n)
+    with Progress(len(equations), 'equations', progress) as report:
+        for count in sorted(partitions):
+            solutions = collections.defaultdict(set)
+            for eq_id in partitions[count]:
+                eq = equations[eq_id]
+                for riddle in move_neighbourhoods(
+                    equation_values(n)[eq_id], m, truth=False, kind=kind
+                )[m]:
+                    solutions[expr_string(riddle)].add(eq)
+                report.update()
+            for riddle, riddle_solutions in sorted(solutions.items()):
+                if moves:
+                    values = expr_values(riddle)
+                    riddle_solutions = {
+                        eq: pack_moves(
+                            move_descriptors(values, expr_values(eq))
+                        )
+                        for eq in sorted(riddle_solutions)
+                    }
+                yield riddle, riddle_solutions
+
+
+def map_solutions(
+    n: int, m: int = 1, progress: bool = False, memory_budget=None,
+    kind: str = 'move', processes=None
+) -> dict[str, set[str]]:
+    """
+    Given number of digits and number of moves return mapping of
+    riddle to set of possible solutions
+
+    memory_budget: if given, build the mapping from sorted runs spilled
+    to disk, see iter_spilled_solutions, instead of the memoised graph
+    kind: 'move', 'add' or 'remove' matches puzzles, see PUZZLE_KINDS
+    processes: if given, solve in a pool of worker processes sharing the
+    tables, see parallel_map_solutions
+
+    >>> map_solutions(2):
+    {"2 = 3": {"2 = 2", "3 = 3"}, ...}
+    """
+    if memory_budget is not None:
+        return dict(
+            iter_spilled_solutions(n, m, memory_budget, progress, kind)
+        )
+    if processes is not None and (n, m, kind) not in _move_graphs:
+        return parallel_map_solutions(n, m, processes, progress, kind)
+    graph = move_graph(n, m, progress, kind)
+    solutions = collections.defaultdict(set)
+    for eq, riddles in graph.items():
+        for key in riddles:
+            solutions[key].add(eq)
+    return solutions
+
+
+def unique_puzzles(
+    n: int, m: int = 1, progress: bool = False, kind: str = 'move'
+) -> dict[str, set[str]]:
+    """
+    Return mapping of the riddles with exactly one solution to it,
+    without building the sets of solutions of all riddles
+
+    Riddles are kept as encoded integers against the id of the first
+    equation that reaches them. A riddle reached by a second equation is
+    dropped and remembered as ambiguous, so later equations reaching it
+    skip it at the cost of a set lookup.
+
+    >>> unique_puzzles(2)
+    {'3 = 8': {'9 = 9'}, '8 = 3': {'9 = 9'}}
+    """
+    first = {}
+    ambiguous = set()
+    equations = equation_list(n)
+    with Progress(len(equations), 'equations', progress) as report:
+        for eq_id, values in enumerate(equation_values(n)):
+            for riddle in move_neighbourhoods(
+                values, m, truth=False, kind=kind
+            )[m]:
+                code = encode(riddle)
+                if code in ambiguous:
+                    continue
+                if code in first:
+                    del first[code]
+                    ambiguous.add(code)
+                else:
+                    first[code] = eq_id
+            report.update()
+    return {
+        expr_string(decode(code)): {equations[eq_id]}
+        for code, eq_id in sorted(first.items())
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def equation_list(n: int) -> tuple[str, ...]:
+    """
+    Sorted tuple of valid equations with n digits, computed once or
+    read from loaded tables
+    """
+    tables = get_tables()
+    if tables is not None and tables.has_equations(n):
+        return tuple(expr_string(values) for values in tables.equations(n))
+    return tuple(sorted(valid_equations(n)))
+
+
+@functools.lru_cache(maxsize=None)
+def equation_values(n: int) -> tuple[tuple, ...]:
+    """
+    Token values of equation_list(n), so that an equation id, its index
+    in the list, maps directly to its values
+    """
+    tables = get_tables()
+    if tables is not None and tables.has_equations(n):
+        return tables.equations(n)
+    return tuple(_parse(eq) for eq in equation_list(n))
+
+
+def equation_tokens(n: int, eq_id: int) -> list[Token]:
+    return tokens_from_values(equation_values(n)[eq_id])
+
+
+INVERSE_KINDS = {'move': 'move', 'add': 'remove', 'remove': 'add'}
+
+
+def solutions_of(riddle: str, m: int = 1, kind: str = 'move'):
+    """
+    Backward search: yield valid equations obtained by moving
+    m matches in riddle (or adding/removing them, see PUZZLE_KINDS)
+
+    >>> sorted(solutions_of("2 = 3"))
+    ['2 = 2', '3 = 3']
+    """
+    for candidate in move_neighbourhoods(
+        expr_values(riddle), m, truth=True, kind=INVERSE_KINDS[kind]
+    )[m]:
+        yield expr_string(candidate)
+
+
+def sample_puzzles(
+    n: int, m: int = 1, count: int = 1, solutions: int = 1,
+    seed=None, max_tries: int = 10000, kind: str = 'move'
+) -> dict[str, set[str]]:
+    """
+    Draw random riddles with n digits and exactly the given number of
+    solutions when moving m matches, without mapping all equations
+
+    Random valid equations are perturbed by m random moves; the candidate
+    riddles with a single '=' that are not trivially true are verified
+    with a backward search. The result is reproducible for a given seed.
+    """
+    rng = random.Random(seed)
+    equations = equation_list(n)
+    found = {}
+    for _ in range(max_tries):
+        if len(found) >= count:
+            break
+        eq = rng.choice(equations)
+        riddles = sorted(
+            expr_string(r)
+            for r in move_neighbourhoods(
+                expr_values(eq), m, truth=False, kind=kind
+            )[m]
+        )
+        if not riddles:
+            continue
+        riddle = rng.choice(riddles)
+        if riddle in found:
+            continue
+        riddle_solutions = set(
+            itertools.islice(solutions_of(riddle, m, kind), solutions + 1)
+        )
+        if len(riddle_solutions) == solutions:
+            found[riddle] = riddle_solutions
+    return found
+
+
+INDEX_FIELDS = ('digits', 'moves', 'kind', 'solutions', 'pattern', 'matches')
+TEXT_FIELDS = ('kind', 'pattern')
+
+
+def riddle_features(riddle: str) -> dict:
+    """
+    Return index features of riddle determined by its tokens
+
+    >>> riddle_features("1 + 7 = 8")
+    {'digits': 3, 'pattern': '+=', 'matches': 14}
+    """
+    tokens = scan(riddle)
+    return {
+        'digits': sum(isinstance(t, Digit) for t in tokens),
+        'pattern': "".join(str(t) for t in tokens if isinstance(t, Operator)),
+        'matches': sum(len(t) for t in tokens),
+    }
+
+
+def build_index(
+    n: int, m: int = 1, index=None, kind: str = 'move'
+) -> list:
+    """
+    Add riddles of n digits and m moves of a puzzle kind to a puzzle index
+
+    The index is a list of groups, one per combination of INDEX_FIELDS,
+    each holding its riddles and their sorted solutions. Groups of the
+    same (digits, moves, kind) in an existing index are replaced; groups
+    of indexes without kind are move puzzles.
+    """
+    index = [
+        group for group in index or []
+        if (group['digits'], group['moves'], group.get('kind', 'move'))
+        != (n, m, kind)
+    ]
+    groups = {}
+    for riddle, solutions in map_solutions(n, m, kind=kind).items():
+        features = riddle_features(riddle)
+        features.update(moves=m, kind=kind, solutions=len(solutions))
+        key = tuple(features[field] for field in INDEX_FIELDS)
+        group = groups.setdefault(key, {**features, 'riddles': {}})
+        group['riddles'][riddle] = sorted(solutions)
+    index.extend(groups[key] for key in sorted(groups))
+    return index
+
+
+def save_index(index: list, index_file) -> None:
+    with open(index_file, 'w') as f:
+        json.dump(index, f)
+
+
+def load_index(index_file) -> list:
+    index_file = pathlib.Path(index_file)
+    if not index_file.exists():
+        return []
+    with open(index_file) as f:
+        return json.load(f)
+
+
+def query_index(index: list, **criteria) -> dict[str, list[str]]:
+    """
+    Return riddles of index groups matching all criteria
+
+    >>> query_index(index, solutions=1, moves=2)
+    {"2 - 7 = 1": ["2 + 1 = 3"], ...}
+    """
+    unknown = set(criteria) - set(INDEX_FIELDS)
+    if unknown:
+        raise ValueError(f'Unknown index fields {sorted(unknown)}')
+    riddles = {}
+    for group in index:
+        group = {'kind': 'move', **group}
+        if all(group[field] == value for field, value in criteria.items()):
+            riddles.update(group['riddles'])
+    return riddles
+
+
+def parse_query(terms: list[str]) -> dict:
+    """
+    Parse field=value terms of the command line
+
+    >>> parse_query(['solutions=1', 'pattern=+=', 'kind=add'])
+    {'solutions': 1, 'pattern': '+=', 'kind': 'add'}
+    """
+    criteria = {}
+    for term in terms:
+        field, _, value = term.partition('=')
+        criteria[field] = value if field in TEXT_FIELDS else int(value)
+    return criteria
+
+
+def _segment_masks():
+    return {
+        value: sum(1 << segment for segment in occupied)
+        for cls in (Digit, Operator)
+        for value, occupied in cls.occupied.items()
+    }
+
+
+SEGMENT_MASKS = _segment_masks()
+
+
+def segment_mask(values: tuple) -> int:
+    """
+    Pack the segments of an expression into one integer, seven bits per
+    position, first position in the highest bits
+
+    >>> bin(segment_mask((1, '=', 1)))
+    '0b10010000000100100100'
+    """
+    mask = 0
+    for value in values:
+        mask = mask << 7 | SEGMENT_MASKS[value]
+    return mask
+
+
+def field_mask(values: tuple, bits: int = 0b1111111, operators=None) -> int:
+    """
+    Repeat bits in the seven-bit field of every position, or only of
+    operator (True) or digit (False) positions
+    """
+    mask = 0
+    for value in values:
+        keep = operators is None or isinstance(value, str) is operators
+        mask = mask << 7 | (bits if keep else 0)
+    return mask
+
+
+def field_counts(mask: int, low: int) -> int:
+    """
+    Count set bits of every seven-bit field at once; low has the lowest
+    bit of each field set and the counts end up in the fields
+    """
+    return sum((mask >> bit) & low for bit in range(7))
+
+
+MOVE_SITE_BITS = 8
+NO_SITE = (1 << MOVE_SITE_BITS) - 1
+
+
+def move_descriptors(riddle: tuple, solution: tuple) -> tuple[int, ...]:
+    """
+    Return the matches moved to turn riddle into solution, each packed
+    as source << 8 | destination site, where a site is position*7 +
+    segment and NO_SITE stands for the pile of add/remove puzzles
+
+    The sites are read off the segment masks of the pair; sources and
+    destinations are paired in site order.
+
+    >>> move_descriptors((3, '=', 8), (9, '=', 9))
+    (4609,)
+    """
+    r, s = segment_mask(riddle), segment_mask(solution)
+    last = len(riddle) - 1
+
+    def sites(mask):
+        return sorted(
+            (last - bit // 7) * 7 + bit % 7
+            for bit in range(mask.bit_length()) if mask >> bit & 1
+        )
+
+    sources, destinations = sites(r & ~s), sites(s & ~r)
+    return tuple(
+        src << MOVE_SITE_BITS | dst
+        for src, dst in itertools.zip_longest(
+            sources, destinations, fillvalue=NO_SITE
+        )
+    )
+
+
+def descriptor_sites(descriptors) -> tuple[list, list]:
+    """
+    Return (position, segment) sources and destinations of moves, as
+    taken by generate_svg and rasterize: vacated sources and highlighted
+    destinations on the solution
+
+    >>> descriptor_sites((4609,))
+    ([(2, 4)], [(0, 1)])
+    """
+    sources, destinations = [], []
+    for descriptor in descriptors:
+        src, dst = descriptor >> MOVE_SITE_BITS, descriptor & NO_SITE
+        if src != NO_SITE:
+            sources.append(divmod(src, 7))
+        if dst != NO_SITE:
+            destinations.append(divmod(dst, 7))
+    return sources, destinations
+
+
+def pack_moves(descriptors) -> int:
+    """
+    Pack the move descriptors of a riddle/solution pair into one int,
+    16 bits per move
+    """
+    packed = 0
+    for descriptor in reversed(descriptors):
+        packed = packed << 2*MOVE_SITE_BITS | descriptor
+    return packed
+
+
+def unpack_moves(packed: int) -> tuple[int, ...]:
+    descriptors = []
+    while packed:
+        descriptors.append(packed & (1 << 2*MOVE_SITE_BITS) - 1)
+        packed >>= 2*MOVE_SITE_BITS
+    return tuple(descriptors)
+
+
+SCORE_FIELDS = ('solutions', 'crossing', 'operators', 'near_misses')
+
+
+def score_puzzles(
+    n: int, m: int = 1, kind: str = 'move', mapping=None, near: bool = True
+) -> dict[str, dict]:
+    """
+    Return difficulty features of every riddle of the solution map
+
+    solutions: number of solutions
+    crossing: solutions where a match moves between tokens, None for
+        add and remove puzzles, where no match moves
+    operators: solutions that change an operator
+    near_misses: solutions reached by m-1 or m+1 moves instead of m
+
+    Riddles and solutions are packed into segment masks, so that the
+    matches removed and added by a solution, their count per token and
+    changed operators are found with a few integer operations on whole
+    expressions instead of enumerating moves again. Near misses come
+    from the memoised maps of m-1 and m+1 moves (skipped unless near).
+
+    >>> score_puzzles(2)['3 = 8']
+    {'solutions': 1, 'crossing': 1, 'operators': 0, 'near_misses': 2}
+    """
+    if mapping is None:
+        mapping = map_solutions(n, m, kind=kind)
+    neighbours = [
+        map_solutions(n, k, kind=kind)
+        for k in (m - 1, m + 1) if near and k > 0
+    ]
+    masks = {}
+
+    def mask_of(expr):
+        if expr not in masks:
+            masks[expr] = segment_mask(expr_values(expr))
+        return masks[expr]
+
+    scores = {}
+    for riddle, solutions in mapping.items():
+        values = expr_values(riddle)
+        low = field_mask(values, 1)
+        operators = field_mask(values, operators=True)
+        r = mask_of(riddle)
+        crossing = 0 if kind == 'move' else None
+        changed = 0
+        for solution in solutions:
+            s = mask_of(solution)
+            removed, added = r & ~s, s & ~r
+            if crossing is not None and \
+                    field_counts(removed, low) != field_counts(added, low):
+                crossing += 1
+            if (r ^ s) & operators:
+                changed += 1
+        near_misses = set()
+        for other in neighbours:
+            near_misses.update(other.get(riddle, ()))
+        scores[riddle] = dict(
+            solutions=len(solutions),
+            crossing=crossing,
+            operators=changed,
+            near_misses=len(near_misses - set(solutions)),
+        )
+    return scores
+
+
+def save_scores(scores: dict, mapping, score_file) -> None:
+    """
+    Write riddle scores and solutions as CSV, one riddle per row
+    """
+    with open(score_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('riddle',) + SCORE_FIELDS + ('equations',))
+        for riddle in sorted(scores):
+            writer.writerow(
+                (riddle,)
+                + tuple(scores[riddle][field] for field in SCORE_FIELDS)
+                + ("; ".join(sorted(mapping[riddle])),)
+            )
+
+
+def map_equation_solutions(
+    equations, m: int = 1, kind: str = 'move'
+) -> dict[str, set[str]]:
+    """
+    Return mapping of riddles to solutions among the given equations
+    """
+    solutions = collections.defaultdict(set)
+    for eq in equations:
+        for riddle in move_neighbourhoods(
+            expr_values(eq), m, truth=False, kind=kind
+        )[m]:
+            solutions[expr_string(riddle)].add(eq)
+    return solutions
+
+
+SHARD_FILES = (
+    'shards.json', 'shard-*.task', 'shard-*.claimed', 'shard-*.partial',
+    'shard-*.json'
+)
+
+
+def init_shards(
+    workdir, n: int, m: int = 1, shards: int = 1, kind: str = 'move'
+) -> list:
+    """
+    Split the solution map of n digits and m moves into shards of
+    equation id ranges, written as task files of a work directory
+
+    Workers on any host sharing the directory claim tasks with
+    work_shards; merge_shards combines their results. Files of an
+    earlier build in the directory are removed, and tasks and results
+    carry a new build id, so that late results of that build are not
+    taken for results of this one.
+    """
+    workdir = pathlib.Path(workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    for pattern in SHARD_FILES:
+        for path in workdir.glob(pattern):
+            path.unlink(missing_ok=True)
+    build = os.urandom(8).hex()
+    total = len(equation_list(n))
+    bounds = [total * i // shards for i in range(shards + 1)]
+    tasks = []
+    for i, (start, stop) in enumerate(zip(bounds, bounds[1:])):
+        task = workdir / f'shard-{i:04d}.task'
+        with open(task, 'w') as f:
+            json.dump(
+                {
+                    'n': n, 'm': m, 'kind': kind, 'start': start,
+                    'stop': stop, 'build': build
+                },
+                f
+            )
+        tasks.append(task)
+    with open(workdir / 'shards.json', 'w') as f:
+        json.dump(
+            {'n': n, 'm': m, 'kind': kind, 'shards': shards, 'build': build},
+            f
+        )
+    return tasks
+
+
+def requeue_stale_shards(workdir, stale_after: float) -> list:
+    """
+    Return claims older than stale_after seconds to the queue, the
+    tasks of workers that died; returns the requeued tasks
+    """
+    requeued = []
+    now = time.time()
+    for claimed in sorted(pathlib.Path(workdir).glob('shard-*.claimed')):
+        try:
+            if now - claimed.stat().st_mtime < stale_after:
+                continue
+            task = claimed.with_suffix('.task')
+            os.rename(claimed, task)
+        except FileNotFoundError:
+            continue
+        requeued.append(task)
+    return requeued
+
+
+def claim_shard(workdir, stale_after=None):
+    """
+    Claim a pending task by renaming it, which only one worker can do,
+    and return the claimed file or None if no tasks are left
+
+    stale_after: if given and no tasks are pending, first requeue claims
+    older than that many seconds, see requeue_stale_shards
+    """
+    for attempt in range(2):
+        for task in sorted(pathlib.Path(workdir).glob('shard-*.task')):
+            claimed = task.with_suffix('.claimed')
+            try:
+                os.rename(task, claimed)
+            except FileNotFoundError:
+                continue
+            # the claim's age counts from now, not from init_shards
+            os.utime(claimed)
+            return claimed
+        if stale_after is None:
+            break
+        if not requeue_stale_shards(workdir, stale_after):
+            break
+    return None
+
+
+def work_shards(workdir, progress: bool = False, stale_after=None) -> int:
+    """
+    Claim and solve tasks until none are left, writing one result file
+    per shard; returns the number of shards solved
+
+    stale_after: seconds after which claims of other workers are taken
+    over, see claim_shard. Results of a build that was replaced by
+    init_shards meanwhile are dropped.
+    """
+    workdir = pathlib.Path(workdir)
+    with Progress(None, 'shards', progress) as report:
+        while (claimed := claim_shard(workdir, stale_after)) is not None:
+            with open(claimed) as f:
+                task = json.load(f)
+            equations = equation_list(task['n'])[task['start']:task['stop']]
+            mapping = map_equation_solutions(
+                equations, task['m'], task['kind']
+            )
+            fd, partial = tempfile.mkstemp(
+                suffix='.partial', prefix=claimed.stem, dir=workdir
+            )
+            with open(fd, 'w') as f:
+                json.dump(
+                    {
+                        'build': task.get('build'),
+                        'riddles': {r: sorted(s) for r, s in mapping.items()}
+                    },
+                    f
+                )
+            if shard_meta(workdir).get('build') != task.get('build'):
+                os.unlink(partial)
+                continue
+            os.rename(partial, claimed.with_suffix('.json'))
+            claimed.unlink(missing_ok=True)
+            report.update()
+    return report.done
+
+
+def shard_meta(workdir) -> dict:
+    with open(pathlib.Path(workdir) / 'shards.json') as f:
+        return json.load(f)
+
+
+def merge_shards(workdir) -> dict[str, set[str]]:
+    """
+    Combine the shard results of a work directory into the solution map
+    """
+    workdir = pathlib.Path(workdir)
+    meta = shard_meta(workdir)
+    results = []
+    for path in sorted(workdir.glob('shard-*.json')):
+        with open(path) as f:
+            result = json.load(f)
+        if result.get('build') == meta.get('build'):
+            results.append(result)
+    if len(results) != meta['shards']:
+        raise RuntimeError(
+            f'{meta["shards"] - len(results)} of {meta["shards"]} shards '
+            f'unfinished in {workdir}'
+        )
+    solutions = collections.defaultdict(set)
+    for result in results:
+        for riddle, riddle_solutions in result['riddles'].items():
+            solutions[riddle].update(riddle_solutions)
+    return solutions
+
+
+class SharedTables:
+    """
+    Move tables and equation lists packed into a shared memory block,
+    attached by name in worker processes instead of being rebuilt or
+    pickled per worker, see attach_tables
+
+    >>> with SharedTables(equations=(4,)) as shared:
+    ...     pool = multiprocessing.Pool(initializer=attach_tables,
+    ...                                 initargs=shared.initargs)
+    """
+    def __init__(self, digits=(), moves=(1,), equations=()):
+        from multiprocessing import shared_memory
+
+        data = pack_tables(table_sections(digits, moves, equations))
+        self.shm = shared_memory.SharedMemory(create=True, size=len(data))
+        self.shm.buf[:len(data)] = data
+        self.name = self.shm.name
+        self.initargs = (self.name, glyph_spec())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+_shared_memory = None
+
+
+def attach_tables(name, glyphs=None):
+    """
+    Use the shared tables of the given name in this process, e.g. as
+    initializer of pool workers, with the glyph set they were built for
+    """
+    from multiprocessing import shared_memory
+
+    global _tables, _shared_memory
+    if glyphs is not None:
+        use_glyphs(glyphs)
+    _shared_memory = shared_memory.SharedMemory(name)
+    _tables = MoveTables(buffer=_shared_memory.buf)
+    token_moves.cache_clear()
+    _move_graphs.clear()
+    return _tables
+
+
+def _solve_equation_range(task):
+    n, m, kind, start, stop = task
+    return map_equation_solutions(equation_list(n)[start:stop], m, kind)
+
+
+def parallel_map_solutions(
+    n: int, m: int = 1, processes=None, progress: bool = False,
+    kind: str = 'move'
+) -> dict[str, set[str]]:
+    """
+    Map riddles to solutions in a process pool; the equations are split
+    into ranges of ids, read by the workers from shared tables
+    """
+    import multiprocessing
+
+    processes = processes or os.cpu_count()
+    total = len(equation_list(n))
+    chunks = 4 * processes
+    bounds = [total * i // chunks for i in range(chunks + 1)]
+    tasks = [
+        (n, m, kind, start, stop)
+        for start, stop in zip(bounds, bounds[1:]) if start < stop
+    ]
+    solutions = collections.defaultdict(set)
+    with SharedTables(equations=(n,)) as shared, \
+            multiprocessing.Pool(
+                processes, attach_tables, shared.initargs
+            ) as pool, \
+            Progress(len(tasks), 'chunks', progress) as report:
+        for mapping in pool.imap_unordered(_solve_equation_range, tasks):
+            for riddle, riddle_solutions in mapping.items():
+                solutions[riddle].update(riddle_solutions)
+            report.update()
+    return solutions
+
+
+def _solve_riddle(task):
+    riddle, m, kind = task
+    return riddle, set(solutions_of(riddle, m, kind))
+
+
+def solve_riddles(
+    riddles, m: int = 1, kind: str = 'move', processes=None,
+    progress: bool = False
+) -> dict[str, set[str]]:
+    """
+    Return solutions of each riddle, solved by backward search in a
+    process pool whose workers attach the shared token tables
+    """
+    import multiprocessing
+
+    riddles = list(riddles)
+    solutions = {}
+    with SharedTables() as shared, \
+            multiprocessing.Pool(
+                processes, attach_tables, shared.initargs
+            ) as pool, \
+            Progress(len(riddles), 'riddles', progress) as report:
+        for riddle, riddle_solutions in pool.imap(
+            _solve_riddle, ((r, m, kind) for r in riddles), chunksize=64
+        ):
+            solutions[riddle] = riddle_solutions
+            report.update()
+    return solutions
+
+
+GLYPH_DIR = pathlib.Path(__file__).with_name('img')
+GLYPHS = '0123456789+-='
+
+
+def glyph_cache_dir():
+    """
+    Disk cache of glyph boxes and resampled glyphs, $MATCHSTICK_GLYPH_CACHE
+    or img/cache next to this module
+    """
+    return pathlib.Path(
+        os.environ.get('MATCHSTICK_GLYPH_CACHE', GLYPH_DIR / 'cache')
+    )
+
+
+def _detect_box(img, threshold=40):
+    """
+    Bounding box of the dark matches on the light background of a glyph
+    """
+    from PIL import ImageOps
+
+    ink = ImageOps.invert(img.convert('L'))
+    return ink.point(lambda v: 255 if v > threshold else 0).getbbox()
+
+
+@functools.lru_cache(maxsize=None)
+def glyph_boxes(pad=20) -> dict[str, tuple[int, int, int, int]]:
+    """
+    Crop boxes of the glyph images, detected once and kept on disk
+
+    Each glyph is cropped tightly to its matches horizontally, plus pad.
+    All glyphs share the vertical extent of the union of their matches,
+    so that composed glyphs stay aligned.
+    """
+    from PIL import Image
+
+    sources = {c: GLYPH_DIR / f'm{c}.jpg' for c in GLYPHS}
+    box_file = glyph_cache_dir() / 'boxes.json'
+    stamp = max(path.stat().st_mtime for path in sources.values())
+    if box_file.exists() and box_file.stat().st_mtime >= stamp:
+        with open(box_file) as f:
+            cached = json.load(f)
+        if cached['pad'] == pad:
+            return {c: tuple(box) for c, box in cached['boxes'].items()}
+
+    boxes = {}
+    for c, path in sources.items():
+        with Image.open(path) as img:
+            boxes[c] = _detect_box(img), img.size
+    top = min(box[1] for box, _ in boxes.values())
+    bottom = max(box[3] for box, _ in boxes.values())
+    boxes = {
+        c: (max(0, box[0] - pad), top, min(size[0], box[2] + pad), bottom)
+        for c, (box, size) in boxes.items()
+    }
+    try:
+        box_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(box_file, 'w') as f:
+            json.dump({'pad': pad, 'boxes': boxes}, f)
+    except OSError:
+        pass
+    return boxes
+
+
+@functools.lru_cache(maxsize=None)
+def glyph(c, height=None):
+    """
+    Return glyph image cropped to its box and resampled to height,
+    cached in memory and, for resampled glyphs, on disk
+
+    height: output height in pixels, None for the source resolution
+
+    A resampled glyph on disk is reused only while it is newer than its
+    source image and the crop boxes, like boxes.json itself.
+    """
+    from PIL import Image
+
+    source = GLYPH_DIR / f'm{c}.jpg'
+    box = glyph_boxes()[c]
+    if height is not None:
+        cached = glyph_cache_dir() / str(height) / f'm{c}.png'
+        box_file = glyph_cache_dir() / 'boxes.json'
+        stamps = [source.stat().st_mtime]
+        if box_file.exists():
+            stamps.append(box_file.stat().st_mtime)
+        if cached.exists() and cached.stat().st_mtime >= max(stamps):
+            return Image.open(cached).convert('RGB')
+    with Image.open(source) as img:
+        img = img.crop(box)
+    if height is not None:
+        width = max(1, round(img.size[0] * height / img.size[1]))
+        img = img.resize((width, height), Image.Resampling.LANCZOS)
+        try:
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            img.save(cached)
+        except OSError:
+            pass
+    return img
+
+
+def build_glyph_cache(heights):
+    """
+    Resample all glyphs to the given output heights ahead of composing
+    """
+    for height in heights:
+        for c in GLYPHS:
+            glyph(c, height)
+
+
+def generate_image(expr, height=None):
+    """
+    Compose image of expression from the glyph images
+
+    height: output height in pixels; glyphs are resampled once per height
+    and cached, so small images are composed directly at target size
+    """
+    from PIL import Image
+
+    expr = expr.strip().replace(' ', '')
+    images = [glyph(c, height) for c in expr]
+    hsize = sum(image.size[0] for image in images)
+    vsize = max(image.size[1] for image in images)
+    mode = images[0].mode
+    joined_image = Image.new(mode, (hsize, vsize))
+    offset = 0
+    for image in images:
+        joined_image.paste(image, (offset, 0))
+        offset += image.size[0]
+    return joined_image
+
+
+SEGMENT_STYLE = {
+    'width': 60,
+    'height': 100,
+    'pad': 10,
+    'stroke': 8,
+    'color': 'black',
+    'highlight': 'red',
+    'vacated': 'lightgray',
+}
+
+
+def segment_lines(tokens, width=60, height=100, pad=10):
+    """
+    Yield line coordinates of all match positions in a token sequence
+
+    Every item is ((position, segment), (x0, y0, x1, y1), occupied) where
+    the coordinates are in units of the token cell (width x height),
+    offset horizontally by the position in the expression
+
+    >>> next(segment_lines([Digit(1)]))
+    ((0, 0), (10, 10, 50, 10), False)
+    """
+    mid = height // 2
+    digit = {
+        0: (pad, pad, width - pad, pad),
+        1: (pad, pad, pad, mid),
+        2: (width - pad, pad, width - pad, mid),
+        3: (pad, mid, width - pad, mid),
+        4: (pad, mid, pad, height - pad),
+        5: (width - pad, mid, width - pad, height - pad),
+        6: (pad, height - pad, width - pad, height - pad),
+    }
+    arm = width // 2 - pad
+    operator = {
+        None: (pad, mid, width - pad, mid),
+        0: (width // 2, mid - arm, width // 2, mid + arm),
+        1: (pad, mid + 2*pad, width - pad, mid + 2*pad),
+    }
+    for i, t in enumerate(tokens):
+        occupied = set(t.get_occupied())
+        offset = i * width
+        if isinstance(t, Operator):
+            segments = operator
+        else:
+            segments = digit
+        for seg, (x0, y0, x1, y1) in segments.items():
+            yield (
+                (i, seg),
+                (x0 + offset, y0, x1 + offset, y1),
+                seg is None or seg in occupied
+            )
+
+
+def generate_svg(expr, highlight=(), vacated=(), scale=1.0):
+    """
+    Return SVG document of matchstick expression drawn from segment tables
+
+    highlight: (position, segment) pairs drawn in highlight colour,
+        e.g. the destinations of moved matches
+    vacated: (position, segment) pairs drawn faintly,
+        e.g. the origins of moved matches
+
+    >>> generate_svg('1').count('<line')
+    2
+    """
+    tokens = scan(expr)
+    style = SEGMENT_STYLE
+    width = style['width'] * len(tokens)
+    height = style['height']
+    highlight = set(highlight)
+    vacated = set(vacated)
+    lines = []
+    for site, (x0, y0, x1, y1), occupied in segment_lines(
+        tokens, style['width'], style['height'], style['pad']
+    ):
+        if occupied:
+            color = style['highlight'] if site in highlight else style['color']
+            dash = ''
+        elif site in vacated:
+            color = style['vacated']
+            dash = f' stroke-dasharray="{style["stroke"]}"'
+        else:
+            continue
+        lines.append(
+            f'<line x1="{x0}" y1="{y0}" x2="{x1}" y2="{y1}" '
+            f'stroke="{color}"{dash}/>'
+        )
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" '
+        f'width="{width*scale:g}" height="{height*scale:g}" '
+        f'viewBox="0 0 {width} {height}">'
+        f'<g stroke-width="{style["stroke"]}" stroke-linecap="round">'
+        + "".join(lines) +
+        '</g></svg>'
+    )
+
+
+def rasterize(expr, highlight=(), vacated=(), scale=1.0):
+    """
+    Return PIL image of matchstick expression drawn from segment tables,
+    the raster counterpart of generate_svg
+    """
+    from PIL import Image, ImageDraw
+
+    tokens = scan(expr)
+    style = SEGMENT_STYLE
+    size = (
+        round(style['width'] * len(tokens) * scale),
+        round(style['height'] * scale)
+    )
+    img = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(img)
+    highlight = set(highlight)
+    vacated = set(vacated)
+    stroke = max(1, round(style['stroke'] * scale))
+    for site, coords, occupied in segment_lines(
+        tokens, style['width'], style['height'], style['pad']
+    ):
+        if occupied:
+            color = style['highlight'] if site in highlight else style['color']
+        elif site in vacated:
+            color = style['vacated']
+        else:
+            continue
+        draw.line([c * scale for c in coords], fill=color, width=stroke)
+    return img
+
+
+def crop(img, keep=300):
+    width, height = img.size
+    left = width//2 - keep//2
+    right = width//2 + keep//2
+    dim = (left, 0, right, height)
+    imgc = img.crop(dim)
+    return imgc
+
+
+IMAGE_FORMATS = {
+    # format: (PIL format name, zip compression of member)
+    'png': ('PNG', zipfile.ZIP_STORED),
+    'webp': ('WEBP', zipfile.ZIP_STORED),
+    'svg': (None, zipfile.ZIP_DEFLATED),
+}
+
+
+def encode_image(
+    expr, fmt='png', mode=None, compress_level=None, height=None
+):
+    """
+    Return encoded image of expression as bytes
+
+    fmt: 'png', 'webp' or 'svg'
+    mode: PIL image mode to convert to before encoding,
+        e.g. '1' (1-bit), 'L' (greyscale) or 'P' (palette)
+    compress_level: png zlib level (0-9) or webp method (0-6)
+    height: image height in pixels, full resolution if None
+    """
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f'Unknown image format {fmt}')
+    if fmt == 'svg':
+        scale = 1.0 if height is None else height / SEGMENT_STYLE['height']
+        return generate_svg(expr, scale=scale).encode()
+
+    from PIL import Image
+
+    img = generate_image(expr, height)
+    if mode == 'P':
+        img = img.convert('P', palette=Image.Palette.ADAPTIVE)
+    elif mode is not None:
+        img = img.convert(mode)
+
+    options = {}
+    if compress_level is not None:
+        if fmt == 'png':
+            options['compress_level'] = compress_level
+        else:
+            options['method'] = compress_level
+    buffer = io.BytesIO()
+    img.save(buffer, format=IMAGE_FORMATS[fmt][0], **options)
+    return buffer.getvalue()
+
+
+def write_image_to_zip(
+    zip_out, arcname, expr, fmt='png', comment=b'', **options
+):
+    """
+    Encode expression image and write as archive member, storing
+    already-compressed formats without deflating them again
+    """
+    zip_info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+    zip_info.compress_type = IMAGE_FORMATS[fmt][1]
+    zip_info.comment = comment
+    zip_out.writestr(zip_info, encode_image(expr, fmt, **options))
+
+
+def img_filename(eq, fmt='png'):
+    eq = eq.strip().replace(' ', '')
+    filename = f'{eq}.{fmt}'
+    return filename
+
+
+def is_trivial(expr):
+    return eval(expr.replace('=', '==')) is True
+
+
+def create_zip_with_symlink(output_zip_filename, link_source, link_target):
+
+    with zipfile.ZipFile(
+        output_zip_filename, 'w', compression=zipfile.ZIP_DEFLATED
+    ) as zip_out:
+        write_symlink_to_zip(zip_out, link_source, link_target)
+
+
+def write_symlink_to_zip(zip_out, link_source, link_target, comment=b''):
+    zip_info = zipfile.ZipInfo(link_source)
+    zip_info.create_system = 3
+    zip_info.comment = comment
+
+    unix_st_mode = (
+        stat.S_IFLNK | stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR |
+        stat.S_IRGRP | stat.S_IWGRP | stat.S_IXGRP | stat.S_IROTH |
+        stat.S_IWOTH | stat.S_IXOTH
+    )
+
+    zip_info.external_attr = unix_st_mode << 16
+    zip_out.writestr(zip_info, link_target)
+
+
+def member_digest(recipe) -> str:
+    """
+    Digest of what an archive member is made from, e.g.
+    ('image', expr, fmt, options) or ('link', target)
+    """
+    return hashlib.sha1(repr(recipe).encode()).hexdigest()
+
+
+def read_manifest(zip_file) -> dict[str, str]:
+    """
+    Return digests of the members of an archive, kept as member comments
+    in its central directory, or an empty manifest without an archive
+    """
+    zip_file = pathlib.Path(zip_file)
+    if not zip_file.exists():
+        return {}
+    with zipfile.ZipFile(zip_file) as zp:
+        return {info.filename: info.comment.decode() for info in zp.infolist()}
+
+
+def write_archive(
+    zip_file, members, fmt='png', update=False,
+    verbose=False, progress=False, label='members', index=None, **options
+):
+    """
+    Write members, a mapping of archive name to ('image', expr) or
+    ('link', target), to zip file
+
+    Every member carries the digest of its recipe as comment, the
+    manifest of the archive; SVG images are drawn from the glyph set,
+    so their recipes include it. On update only members that are new
+    or changed since the manifest are written: new members are
+    appended, and if any member changed or is gone the unchanged
+    members are copied to a new archive without encoding them again.
+
+    index: optional (archive name, build) of a member written last,
+    build(zp, offsets) returns its data given the local header offsets
+    of all members, see write_puzzle_index
+
+    Returns number of members written.
+    """
+    zip_file = pathlib.Path(zip_file)
+    render = (fmt, tuple(sorted(options.items())))
+    if fmt == 'svg':
+        render += (glyph_digest(),)
+    digests = {
+        arcname: member_digest(
+            recipe + render if recipe[0] == 'image' else recipe
+        )
+        for arcname, recipe in members.items()
+    }
+    if index is not None:
+        digests[index[0]] = member_digest(('index',) + tuple(digests.items()))
+    manifest = read_manifest(zip_file) if update else {}
+    stale = {
+        arcname for arcname, digest in manifest.items()
+        if digests.get(arcname) != digest
+    }
+    todo = [
+        arcname for arcname, digest in digests.items()
+        if manifest.get(arcname) != digest
+    ]
+
+    rewrite = bool(stale)
+    target = zip_file
+    if rewrite:
+        target = zip_file.with_name(f'.{zip_file.name}.tmp')
+    append = manifest and not rewrite
+    with zipfile.ZipFile(target, 'a' if append else 'w') as zp, \
+            Progress(len(todo), label, progress) as report:
+        if rewrite:
+            with zipfile.ZipFile(zip_file) as old:
+                for info in old.infolist():
+                    if info.filename not in stale:
+                        zp.writestr(info, old.read(info))
+        for arcname in todo:
+            comment = digests[arcname].encode()
+            if index is not None and arcname == index[0]:
+                continue
+            kind, value = members[arcname]
+            if kind == 'image':
+                if verbose:
+                    print(value)
+                write_image_to_zip(
+                    zp, arcname, value, fmt, comment=comment, **options
+                )
+            else:
+                if verbose:
+                    print(f'ln -s {value} {arcname}')
+                write_symlink_to_zip(zp, arcname, value, comment=comment)
+            report.update()
+        if index is not None and index[0] in todo:
+            arcname, build = index
+            offsets = {
+                info.filename: info.header_offset for info in zp.infolist()
+            }
+            zip_info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+            zip_info.comment = digests[arcname].encode()
+            data = build(zp, offsets)
+            zp.writestr(zip_info, data)
+            zp.comment = INDEX_COMMENT.pack(
+                INDEX_MAGIC, zp.fp.tell() - len(data), len(data)
+            )
+            report.update()
+    if rewrite:
+        os.replace(target, zip_file)
+    return len(todo)
+
+
+def zip_equalities(
+    zip_file, equalities, path=None, fmt='png',
+    verbose=False, progress=False, update=False, **options
+):
+    """
+    Save equality images in zip file
+
+    verbose: print every equality
+    progress: report progress on stderr
+    update: write only images new or changed since the archive was made
+    options: image encoding options passed to encode_image
+    """
+    zip_file = pathlib.Path(zip_file)
+    if path is None:
+        path = zip_file.stem
+    members = {
+        f'{path}/{img_filename(eq, fmt)}': ('image', eq) for eq in equalities
+    }
+    write_archive(
+        zip_file, members, fmt, update, verbose, progress, 'equalities',
+        **options
+    )
+    print(f'-> {zip_file}')
+
+
+def solution_members(mapping, path, fmt='png') -> dict[str, tuple]:
+    """
+    Archive members of riddles and their solutions: equality images,
+    riddle images and solutions linked to equality images
+    """
+    equalities = functools.reduce(
+        lambda x, y: x | y,
+        (m[1] for m in mapping)
+    )
+    members = {
+        f'{path}/equalities/{img_filename(eq, fmt)}': ('image', eq)
+        for eq in sorted(equalities)
+    }
+    for riddle, solutions in mapping:
+        img_riddle_filename = pathlib.Path(img_filename(riddle, fmt))
+        riddle_dir = (
+            f'{path}/{len(solutions)}-solution-puzzles/'
+            f'{img_riddle_filename.stem}'
+        )
+        members[f'{riddle_dir}/{img_riddle_filename}'] = ('image', riddle)
+        for solution in solutions:
+            img_solution_filename = img_filename(solution, fmt)
+            link = f'{riddle_dir}/solutions/{img_solution_filename}'
+            target = f'../../../equalities/{img_solution_filename}'
+            members[link] = ('link', target)
+    return members
+
+
+INDEX_MAGIC = b'MIDX'
+INDEX_COMMENT = struct.Struct('<4sQQ')
+INDEX_HASH = 0x9E3779B97F4A7C15
+
+
+def _index_slot(code, bits):
+    return ((code * INDEX_HASH) & 0xFFFFFFFFFFFFFFFF) >> (64 - bits)
+
+
+def write_puzzle_index(mapping, path, fmt='png'):
+    """
+    Return (archive name, build) of the puzzle index of zip_solutions,
+    see write_archive
+
+    The index is a hash table in the layout of pack_tables: encoded
+    riddles in open-addressed slots, each with the local header offset
+    of its riddle image followed, for each solution, by its encoding,
+    the header offset of its equality image, the number of moves and
+    their descriptors, see move_descriptors.
+    """
+    def build(zp, offsets):
+        bits = max(1, (2 * len(mapping)).bit_length())
+        slots = [0] * (1 << bits)
+        records = [[] for _ in slots]
+        for riddle, solutions in mapping:
+            code = encode(expr_values(riddle))
+            slot = _index_slot(code, bits)
+            while slots[slot]:
+                slot = (slot + 1) % len(slots)
+            slots[slot] = code
+            img_riddle_filename = pathlib.Path(img_filename(riddle, fmt))
+            riddle_image = (
+                f'{path}/{len(solutions)}-solution-puzzles/'
+                f'{img_riddle_filename.stem}/{img_riddle_filename}'
+            )
+            record = [offsets[riddle_image]]
+            for solution in sorted(solutions):
+                values = expr_values(solution)
+                descriptors = move_descriptors(expr_values(riddle), values)
+                image = f'{path}/equalities/{img_filename(solution, fmt)}'
+                record.extend((
+                    encode(values), offsets[image],
+                    len(descriptors), *descriptors
+                ))
+            records[slot] = record
+        return pack_tables([(b'PUZL', bits, 0, slots, records)])
+
+    return f'{path}/puzzles.idx', build
+
+
+class PuzzleArchive:
+    """
+    Random access to the puzzles of an archive written by zip_solutions
+
+    The index is found from the archive comment and its members from
+    their local headers, so the central directory is never read
+
+    >>> with PuzzleArchive('3-digit-1-move-puzzles.zip') as archive:
+    ...     archive.solutions('6 + 0 = 0')
+    ['0 + 0 = 0', '6 + 0 = 6']
+    """
+    LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
+    def __init__(self, zip_file):
+        with open(zip_file, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        end = len(self._mmap) - INDEX_COMMENT.size
+        magic, offset, size = INDEX_COMMENT.unpack_from(self._mmap, end)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f'{zip_file} has no puzzle index')
+        self._index = MoveTables(
+            buffer=memoryview(self._mmap)[offset:offset + size]
+        )
+        (_, self._bits, _), = self._index.sections
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _record(self, riddle):
+        slots, indptr, edges = self._index.sections[b'PUZL', self._bits, 0]
+        code = encode(expr_values(riddle))
+        slot = _index_slot(code, self._bits)
+        while slots[slot]:
+            if slots[slot] == code:
+                return edges[indptr[slot]:indptr[slot + 1]]
+            slot = (slot + 1) % len(slots)
+        raise KeyError(riddle)
+
+    def _solutions(self, riddle):
+        """
+        Yield encoded solution, image offset and move descriptors
+        """
+        record = self._record(riddle)
+        i = 1
+        while i < len(record):
+            count = int(record[i + 2])
+            yield record[i], record[i + 1], tuple(
+                int(d) for d in record[i + 3:i + 3 + count]
+            )
+            i += 3 + count
+
+    def read(self, offset) -> bytes:
+        """
+        Return data of the archive member at a local header offset
+        """
+        (_, _, _, method, _, _, _, size, _, name, extra) = \
+            self.LOCAL_HEADER.unpack_from(self._mmap, offset)
+        start = offset + self.LOCAL_HEADER.size + name + extra
+        data = self._mmap[start:start + size]
+        if method == zipfile.ZIP_DEFLATED:
+            import zlib
+            data = zlib.decompress(data, -15)
+        return data
+
+    def solutions(self, riddle) -> list[str]:
+        return [
+            expr_string(decode(code)) for code, _, _ in self._solutions(riddle)
+        ]
+
+    def moves(self, riddle) -> dict[str, tuple[int, ...]]:
+        """
+        Return move descriptors of each solution, see move_descriptors
+        """
+        return {
+            expr_string(decode(code)): descriptors
+            for code, _, descriptors in self._solutions(riddle)
+        }
+
+    def riddle_image(self, riddle) -> bytes:
+        return self.read(self._record(riddle)[0])
+
+    def solution_images(self, riddle) -> dict[str, bytes]:
+        return {
+            expr_string(decode(code)): self.read(offset)
+            for code, offset, _ in self._solutions(riddle)
+        }
+
+    def close(self):
+        self._index.close()
+        self._mmap.close()
+
+
+def zip_solutions(
+    zip_file, mapping, path=None, fmt='png',
+    verbose=False, progress=False, update=False, **options
+):
+    """
+    Save riddle images in zip file, with solutions linked to equality images
+    and an index of the puzzles for random access, see PuzzleArchive
+
+    verbose: print every image and link written
+    progress: report progress on stderr
+    update: write only images and links new or changed since the archive
+        was made, see write_archive
+    options: image encoding options passed to encode_image
+    """
+    zip_file = pathlib.Path(zip_file)
+    if path is None:
+        path = zip_file.stem
+    members = solution_members(mapping, path, fmt)
+    written = write_archive(
+        zip_file, members, fmt, update, verbose, progress, 'members',
+        index=write_puzzle_index(mapping, path, fmt), **options
+    )
+    if update:
+        print(f'{zip_file}: {written} of {len(members) + 1} members written')
+    print(f'-> {zip_file}')
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--single-moves', action='store_true',
+        help='List valid single replacements of expression'
+    )
+    parser.add_argument(
+        '--double-moves', action='store_true',
+        help='List valid double replacements of expression'
+    )
+    parser.add_argument(
+        '--triple-moves', action='store_true',
+        help='List valid triple replacements of expression'
+    )
+    parser.add_argument(
+        '--list-equalities', action='store_true',
+        help='List equalities of given dimension'
+    )
+    parser.add_argument(
+        '--zip-equalities', action='store_true',
+        help='Save equality images of given dimension as zip'
+    )
+    parser.add_argument(
+        '--number-of-digits', default=2, type=int,
+        help='Number of digits in expression'
+    )
+    parser.add_argument(
+        '--operators', default='+-',
+        help='Operators besides = allowed in listed equalities'
+    )
+    parser.add_argument(
+        '--number-of-moves', default=1, type=int,
+        help='Number of matches moved'
+    )
+    parser.add_argument(
+        '--glyphs', default=None, metavar='NAME',
+        help='Glyph set of the glyph file ($MATCHSTICK_GLYPHS or glyphs.json)'
+    )
+    parser.add_argument(
+        '--puzzle-kind', default='move', choices=tuple(PUZZLE_KINDS),
+        help='Move, add or remove matches to solve riddles'
+    )
+
+    parser.add_argument(
+        '--map-solutions', action='store_true',
+        help='Map riddle to solutions'
+    )
+    parser.add_argument(
+        '--build-index', action='store_true',
+        help='Add riddles of given digits and moves to puzzle index'
+    )
+    parser.add_argument(
+        '--query', nargs='*', metavar='FIELD=VALUE',
+        help=f'Query puzzle index, fields: {", ".join(INDEX_FIELDS)}'
+    )
+    parser.add_argument(
+        '--index-file', default='puzzle-index.json',
+        help='Puzzle index file'
+    )
+    parser.add_argument(
+        '--sample', default=0, type=int,
+        help='Sample given number of riddles without mapping all solutions'
+    )
+    parser.add_argument(
+        '--number-of-solutions', default=1, type=int,
+        help='Number of solutions of sampled riddles'
+    )
+    parser.add_argument(
+        '--seed', default=None, type=int,
+        help='Random seed of sampling'
+    )
+    parser.add_argument(
+        '--processes', default=None, type=int,
+        help='Solve in a pool of worker processes sharing the move tables'
+    )
+    parser.add_argument(
+        '--solve', metavar='FILE',
+        help='Solve riddles listed one per line in FILE (- for stdin)'
+    )
+    parser.add_argument(
+        '--stream', action='store_true',
+        help='List riddles as soon as their solutions are final, '
+        'grouped by number of matches'
+    )
+    parser.add_argument(
+        '--moves', action='store_true',
+        help='List packed move descriptors of streamed solutions'
+    )
+    parser.add_argument(
+        '--memory-budget', default=None, type=int,
+        help='Number of riddle/solution pairs held in memory before '
+        'spilling to disk; riddles are then listed in riddle order'
+    )
+    parser.add_argument(
+        '--build-tables', metavar='FILE',
+        help='Precompute move tables and one-move graphs into FILE'
+    )
+    parser.add_argument(
+        '--shard-init', metavar='DIR',
+        help='Split solution map into shard tasks in work directory'
+    )
+    parser.add_argument(
+        '--shards', default=1, type=int,
+        help='Number of shards'
+    )
+    parser.add_argument(
+        '--shard-work', metavar='DIR',
+        help='Claim and solve shard tasks of work directory'
+    )
+    parser.add_argument(
+        '--shard-timeout', default=None, type=float, metavar='SECONDS',
+        help='Take over shard claims older than SECONDS, left by dead workers'
+    )
+    parser.add_argument(
+        '--shard-merge', metavar='DIR',
+        help='Merge shard results of work directory into solution map'
+    )
+    parser.add_argument(
+        '--score', metavar='FILE',
+        help='Score riddles by difficulty features and save them as CSV'
+    )
+    parser.add_argument(
+        '--unique', action='store_true',
+        help='Map or zip only riddles with a single solution'
+    )
+    parser.add_argument(
+        '--count', action='store_true',
+        help='Count riddles by number of solutions'
+    )
+    parser.add_argument(
+        '--zip-solutions', action='store_true',
+        help='Save riddle/solution images in zip file'
+    )
+    parser.add_argument(
+        '--update', action='store_true',
+        help='Write only zip members new or changed since the zip was made'
+    )
+
+    parser.add_argument(
+        '--image-format', default='png', choices=('png', 'webp', 'svg'),
+        help='Image format of zip file members'
+    )
+    parser.add_argument(
+        '--image-mode', default=None, choices=('1', 'L', 'P', 'RGB'),
+        help='Image mode: 1-bit, greyscale, palette or full colour'
+    )
+    parser.add_argument(
+        '--compress-level', default=None, type=int,
+        help='Compression level of images (png 0-9, webp 0-6)'
+    )
+    parser.add_argument(
+        '--image-height', default=None, type=int,
+        help='Height of images in pixels, full resolution by default'
+    )
+    parser.add_argument(
+        '--build-glyph-cache', nargs='+', type=int, metavar='HEIGHT',
+        help='Crop and resample glyph images to the given heights'
+    )
+
+    parser.add_argument(
+        '--verbose', action='store_true',
+        help='Print every item written to zip files'
+    )
+    parser.add_argument(
+        '--progress', action='store_true',
+        help='Report progress, rate and ETA of long builds on stderr'
+    )
+
+    parser.add_argument(
+        '--matchstick-image', action='store_true',
+        help='Display matchstick image of expression'
+    )
+    parser.add_argument(
+        '--matchstick-svg', action='store_true',
+        help='Print matchstick SVG of expression'
+    )
+
+    args = parser.parse_args()
+    if args.glyphs:
+        load_glyphs(args.glyphs)
+    image_options = dict(
+        fmt=args.image_format,
+        mode=args.image_mode,
+        compress_level=args.compress_level,
+        height=args.image_height,
+        verbose=args.verbose,
+        progress=args.progress,
+    )
+
+    if args.build_glyph_cache:
+        build_glyph_cache(args.build_glyph_cache)
+        print(f'-> {glyph_cache_dir()}')
+
+    if args.build_tables:
+        build_tables(args.build_tables)
+        print(f'-> {args.build_tables}')
+
+    if args.list_equalities:
+        for eq in valid_equations(args.number_of_digits, args.operators):
+            print(eq)
+    if args.zip_equalities:
+        equations = valid_equations(args.number_of_digits, args.operators)
+        zip_file = f'equalities-{args.number_of_digits}.zip'
+        zip_equalities(
+            zip_file, equations, update=args.update, **image_options
+        )
+
+    if args.map_solutions and args.memory_budget is not None:
+        for riddle, solutions in iter_spilled_solutions(
+            args.number_of_digits, args.number_of_moves,
+            args.memory_budget, args.progress, args.puzzle_kind
+        ):
+            print(f'{riddle}:\t', "\t".join(solutions))
+    elif args.map_solutions and args.stream:
+        for riddle, solutions in iter_solutions(
+            args.number_of_digits, args.number_of_moves, args.progress,
+            args.puzzle_kind, moves=args.moves
+        ):
+            if args.moves:
+                solutions = [
+                    f'{eq} {unpack_moves(packed)}'
+                    for eq, packed in solutions.items()
+                ]
+            print(f'{riddle}:\t', "\t".join(sorted(solutions)), flush=True)
+    elif args.map_solutions and args.unique:
+        mapping = unique_puzzles(
+            args.number_of_digits, args.number_of_moves, args.progress,
+            kind=args.puzzle_kind
+        )
+        for riddle, solutions in mapping.items():
+            print(f'{riddle}:\t', "\t".join(solutions))
+    elif args.map_solutions:
+        mapping = map_solutions(
+            args.number_of_digits, args.number_of_moves, args.progress,
+            kind=args.puzzle_kind, processes=args.processes
+        )
+        mapping = sorted(mapping.items(), key=lambda x: (len(x[1]), x))
+        for riddle, solutions in mapping:
+            print(f'{riddle}:\t', "\t".join(solutions))
+
+    if args.solve:
+        source = sys.stdin.fileno() if args.solve == '-' else args.solve
+        with open(source) as f:
+            riddles = [line.strip() for line in f if line.strip()]
+        mapping = solve_riddles(
+            riddles, args.number_of_moves, args.puzzle_kind, args.processes,
+            args.progress
+        )
+        for riddle, solutions in mapping.items():
+            print(f'{riddle}:\t', "\t".join(sorted(solutions)))
+
+    if args.count:
+        histogram = count_solutions(
+            args.number_of_digits, args.number_of_moves, args.progress,
+            args.puzzle_kind
+        )
+        for k, count in sorted(histogram.items()):
+            print(f'{k}-solution riddles:\t{count}')
+
+    if args.score:
+        mapping = map_solutions(
+            args.number_of_digits, args.number_of_moves, args.progress,
+            kind=args.puzzle_kind
+        )
+        scores = score_puzzles(
+            args.number_of_digits, args.number_of_moves, args.puzzle_kind,
+            mapping
+        )
+        save_scores(scores, mapping, args.score)
+        print(f'-> {args.score}')
+
+    if args.build_index:
+        index = build_index(
+            args.number_of_digits, args.number_of_moves,
+            load_index(args.index_file), args.puzzle_kind
+        )
+        save_index(index, args.index_file)
+        print(f'-> {args.index_file}')
+
+    if args.query is not None:
+        index = load_index(args.index_file)
+        riddles = query_index(index, **parse_query(args.query))
+        for riddle, solutions in riddles.items():
+            print(f'{riddle}:\t', "\t".join(solutions))
+
+    if args.sample:
+        mapping = sample_puzzles(
+            args.number_of_digits, args.number_of_moves,
+            count=args.sample, solutions=args.number_of_solutions,
+            seed=args.seed, kind=args.puzzle_kind
+        )
+        for riddle, solutions in mapping.items():
+            print(f'{riddle}:\t', "\t".join(sorted(solutions)))
+
+    if args.shard_init:
+        tasks = init_shards(
+            args.shard_init, args.number_of_digits, args.number_of_moves,
+            args.shards, args.puzzle_kind
+        )
+        print(f'-> {args.shard_init}: {len(tasks)} shards')
+
+    if args.shard_work:
+        solved = work_shards(
+            args.shard_work, args.progress, args.shard_timeout
+        )
+        print(f'{args.shard_work}: solved {solved} shards')
+
+    if args.shard_merge and not args.zip_solutions:
+        mapping = merge_shards(args.shard_merge)
+        mapping = sorted(mapping.items(), key=lambda x: (len(x[1]), x))
+        for riddle, solutions in mapping:
+            print(f'{riddle}:\t', "\t".join(sorted(solutions)))
+
+    if args.zip_solutions:
+        if args.shard_merge:
+            meta = shard_meta(args.shard_merge)
+            n, m, kind = meta['n'], meta['m'], meta.get('kind', 'move')
+            mapping = merge_shards(args.shard_merge)
+        else:
+            n, m = args.number_of_digits, args.number_of_moves
+            kind = args.puzzle_kind
+            if args.unique:
+                mapping = unique_puzzles(n, m, args.progress, kind=kind)
+            else:
+                mapping = map_solutions(
+                    n, m, args.progress, kind=kind, processes=args.processes
+                )
+        zip_file = f'{n}-digit-{m}-{kind}-puzzles.zip'
+
+        mapping = sorted(mapping.items(), key=lambda x: (len(x[1]), x))
+        zip_solutions(zip_file, mapping, update=args.update, **image_options)
+
+    if args.single_moves:
+        print("Move one matchstick in expression")
+        while expr := input("Expression: "):
+            tokens = scan(expr)
+            moves = move_matches(tokens, n=1)
+            print("Valid moves")
+            for m in moves:
+                print(" ".join(str(t) for t in m))
+
+    if args.double_moves:
+        print("Move two matchsticks in expression")
+        while expr := input("Expression: "):
+            tokens = scan(expr)
+            moves = move_matches(tokens, n=2)
+            print("Valid moves")
+            for m in moves:
+                print(" ".join(str(t) for t in m))
+
+    if args.triple_moves:
+        print("Move three matchsticks in expression")
+        while expr := input("Expression: "):
+            tokens = scan(expr)
+            moves = move_matches(tokens, n=3)
+            print("Valid moves")
+            for m in moves:
+                print(" ".join(str(t) for t in m))
 
     if args.matchstick_image:
         print("Display matchstick image of expression:")
@@ -614,6 +3108,11 @@ if __name__ == "__main__":
             img = generate_image(expr)
             img.show()
 
+    if args.matchstick_svg:
+        print("Print matchstick SVG of expression:")
+        while expr := input("Expression: "):
+            print(generate_svg(expr))
+
 
 class RemovalError(Exception):
     pass
@@ -1,6 +1,8 @@
 """
 TBD
 """
+import digits
+
 
 DIGIT_TEMPLATE = """
  {0}
@@ -11,70 +13,18 @@ DIGIT_TEMPLATE = """
 """
 
 
+HEAVY = ['━━', '┃', '┃', '━━', '┃', '┃', '━━']
+LIGHT = ['──', '│', '│', '──', '│', '│', '──']
+
+
 class Digit:
     def __init__(self, value):
         self.value = value
 
     def __repr__(self):
-        matches = ['──', '│', '│', '──', '│', '│', '──']
-        if self.value == 1:
-            matches[2] = '┃'
-            matches[5] = '┃'
-        elif self.value == 2:
-            matches[0] = '━━'
-            matches[2] = '┃'
-            matches[3] = '━━'
-            matches[4] = '┃'
-            matches[6] = '━━'
-        elif self.value == 3:
-            matches[0] = '━━'
-            matches[2] = '┃'
-            matches[3] = '━━'
-            matches[5] = '┃'
-            matches[6] = '━━'
-        elif self.value == 4:
-            matches[1] = '┃'
-            matches[2] = '┃'
-            matches[3] = '━━'
-            matches[5] = '┃'
-        elif self.value == 5:
-            matches[0] = '━━'
-            matches[1] = '┃'
-            matches[3] = '━━'
-            matches[5] = '┃'
-            matches[6] = '━━'
-        elif self.value == 6:
-            matches[0] = '━━'
-            matches[1] = '┃'
-            matches[3] = '━━'
-            matches[4] = '┃'
-            matches[5] = '┃'
-            matches[6] = '━━'
-        elif self.value == 7:
-            matches[0] = '━━'
-            matches[2] = '┃'
-            matches[5] = '┃'
-        elif self.value == 8:
-            matches[0] = '━━'
-            matches[1] = '┃'
-            matches[2] = '┃'
-            matches[3] = '━━'
-            matches[4] = '┃'
-            matches[5] = '┃'
-            matches[6] = '━━'
-        elif self.value == 9:
-            matches[0] = '━━'
-            matches[1] = '┃'
-            matches[2] = '┃'
-            matches[3] = '━━'
-            matches[5] = '┃'
-            matches[6] = '━━'
-        elif self.value == 0:
-            matches[0] = '━━'
-            matches[1] = '┃'
-            matches[2] = '┃'
-            matches[4] = '┃'
-            matches[5] = '┃'
-            matches[6] = '━━'
-
+        occupied = digits.Digit.occupied[self.value]
+        matches = [
+            HEAVY[site] if site in occupied else LIGHT[site]
+            for site in range(7)
+        ]
         return DIGIT_TEMPLATE.format(*matches)
@@ -1,5 +1,10 @@
+import collections
+import io
+import os
 import pathlib
 import subprocess
+import sys
+import zipfile
 
 import pytest
 from hypothesis import given
@@ -8,11 +13,41 @@ from hypothesis.strategies import integers
 from digits import (
     token, Operator, Digit, move_matches, remove_matches, scan,
     valid_equations, img_filename, create_zip_with_symlink, is_trivial,
-    map_solutions,
+    map_solutions, generate_svg, rasterize, encode_image, zip_equalities,
+    solutions_of, sample_puzzles,
+    riddle_features, build_index, save_index, load_index, query_index,
+    parse_query, token_moves, move_neighbourhoods, move_graph, expr_values,
+    expr_string,
+    evaluate, coefficients, balanced_digits, equation_list,
+    encode, decode, count_solutions, Progress, iter_spilled_solutions,
+    init_shards, claim_shard, work_shards, merge_shards,
+    requeue_stale_shards,
+    scan_values, equation_tokens, build_tables, load_tables,
+    table_sections, pack_tables, MoveTables,
+    add_matches, neighbourhood, unique_puzzles,
+    segment_mask, field_mask, field_counts, score_puzzles, save_scores,
+    generate_image, glyph, glyph_boxes, build_glyph_cache,
+    zip_solutions, read_manifest,
+    read_glyph_set, compile_glyphs, load_glyphs, get_tables,
+    SharedTables, attach_tables, parallel_map_solutions, solve_riddles,
+    equation_values, PuzzleArchive, iter_solutions, match_count,
+    move_descriptors, descriptor_sites, pack_moves, unpack_moves, NO_SITE,
+    PUZZLE_KINDS,
     RemovalError, AdditionError
 )
 
 
+@pytest.fixture(scope='session')
+def glyph_cache_root(tmp_path_factory):
+    return tmp_path_factory.mktemp('glyphs')
+
+
+@pytest.fixture(autouse=True)
+def isolated_glyph_cache(glyph_cache_root, monkeypatch):
+    """Keep rendered glyphs and boxes.json out of the source tree"""
+    monkeypatch.setenv('MATCHSTICK_GLYPH_CACHE', str(glyph_cache_root))
+
+
 class TestDigit:
 
     @pytest.mark.parametrize(
@@ -319,6 +354,29 @@ def test_op_from_occupied(occupied, value):
     assert op.value == value
 
 
+def test_table_sections_ignore_loaded_tables(monkeypatch):
+    """
+    Rebuilding tables computes them again rather than copying the
+    loaded ones
+    """
+    fresh = table_sections(digits=(2,))
+    bogus = [
+        (kind, n, m, nodes, [[] for _ in nodes])
+        for kind, n, m, nodes, _ in fresh
+    ]
+    tables = MoveTables(buffer=pack_tables(bogus))
+    monkeypatch.setattr('digits._tables', tables)
+    monkeypatch.setattr('digits._move_graphs', {})
+    token_moves.cache_clear()
+    assert get_tables() is tables
+    assert table_sections(digits=(2,)) == fresh
+
+
+def test_move_tables_invalid_buffer():
+    with pytest.raises(ValueError, match='buffer'):
+        MoveTables(buffer=bytes(12))
+
+
 @pytest.mark.parametrize(
     'seq, expected',
     [
@@ -551,3 +609,981 @@ def test_map_solutions32():
         "8 - 6 = 2",
         "3 + 5 = 8",
     }
+
+
+@pytest.mark.parametrize(
+    'expr, lines',
+    [
+        ('1', 2),
+        ('8', 7),
+        ('1 + 7 = 8', 2 + 2 + 3 + 2 + 7),
+        ('2 - 2', 5 + 1 + 5),
+    ]
+)
+def test_svg_draws_occupied_matches(expr, lines):
+    svg = generate_svg(expr)
+    assert svg.startswith('<svg')
+    assert svg.count('<line') == lines
+
+
+def test_svg_highlight():
+    svg = generate_svg('1 = 7', highlight=[(2, 0)], vacated=[(1, 0)])
+    assert svg.count('stroke="red"') == 1
+    assert svg.count('stroke="lightgray"') == 1
+
+
+def test_rasterize_size():
+    img = rasterize('1 = 7', scale=0.5)
+    assert img.size == (90, 50)
+
+
+@pytest.mark.parametrize(
+    'fmt, mode, magic',
+    [
+        ('png', None, b'\x89PNG'),
+        ('png', '1', b'\x89PNG'),
+        ('webp', 'L', b'RIFF'),
+        ('svg', None, b'<svg'),
+    ]
+)
+def test_encode_image(fmt, mode, magic):
+    assert encode_image('1 = 1', fmt, mode=mode).startswith(magic)
+
+
+def test_encode_image_unknown_format():
+    with pytest.raises(ValueError):
+        encode_image('1 = 1', 'bmp')
+
+
+@pytest.mark.parametrize(
+    'fmt, compress_type',
+    [
+        ('png', zipfile.ZIP_STORED),
+        ('svg', zipfile.ZIP_DEFLATED),
+    ]
+)
+def test_zip_equalities_compression(tmp_path, fmt, compress_type):
+    zip_file = tmp_path / 'eqs.zip'
+    zip_equalities(zip_file, ['1 = 1'], fmt=fmt, mode='1', compress_level=1)
+    with zipfile.ZipFile(zip_file) as zp:
+        info, = zp.infolist()
+    assert info.filename == f'eqs/1=1.{fmt}'
+    assert info.compress_type == compress_type
+
+
+def test_import_does_not_load_pil():
+    code = 'import sys, digits; print("PIL" in sys.modules)'
+    output = subprocess.check_output([sys.executable, '-c', code], text=True)
+    assert output.strip() == 'False'
+
+
+def test_solutions_of():
+    assert set(solutions_of("2 = 3")) == {"2 = 2", "3 = 3"}
+
+
+@pytest.mark.parametrize('solutions', [1, 2])
+def test_sample_puzzles(solutions):
+    sample = sample_puzzles(3, 1, count=5, solutions=solutions, seed=0)
+    mapping = map_solutions(3, 1)
+    assert len(sample) == 5
+    for riddle, riddle_solutions in sample.items():
+        assert len(riddle_solutions) == solutions
+        assert mapping[riddle] == riddle_solutions
+
+
+def test_sample_puzzles_seed():
+    assert sample_puzzles(3, 1, count=3, seed=7) == \
+        sample_puzzles(3, 1, count=3, seed=7)
+
+
+def test_riddle_features():
+    assert riddle_features("1 + 7 = 8") == {
+        'digits': 3, 'pattern': '+=', 'matches': 14
+    }
+
+
+def test_query_index(tmp_path):
+    index_file = tmp_path / 'index.json'
+    assert load_index(index_file) == []
+    index = build_index(2, 1)
+    index = build_index(3, 1, index)
+    save_index(index, index_file)
+    index = load_index(index_file)
+
+    mapping = map_solutions(3, 1)
+    unique = query_index(index, digits=3, moves=1, solutions=1)
+    assert unique == {
+        riddle: sorted(solutions)
+        for riddle, solutions in mapping.items() if len(solutions) == 1
+    }
+    assert query_index(index, digits=2, pattern='=')["2 = 3"] == \
+        ["2 = 2", "3 = 3"]
+
+
+def test_build_index_replaces_groups():
+    index = build_index(2, 1, build_index(2, 1))
+    assert len(query_index(index)) == len(map_solutions(2, 1))
+
+
+def test_build_index_kinds():
+    index = build_index(2, 1, build_index(2, 1, kind='add'))
+    assert query_index(index, kind='add') == {
+        riddle: sorted(solutions)
+        for riddle, solutions in map_solutions(2, 1, kind='add').items()
+    }
+    assert query_index(index, kind='move') == {
+        riddle: sorted(solutions)
+        for riddle, solutions in map_solutions(2, 1).items()
+    }
+    legacy = [
+        {k: v for k, v in group.items() if k != 'kind'}
+        for group in build_index(2, 1)
+    ]
+    assert query_index(legacy, kind='move') == query_index(index, kind='move')
+    assert len(build_index(2, 1, legacy)) == len(legacy)
+
+
+def test_parse_query():
+    assert parse_query(['solutions=1', 'pattern=+=', 'kind=add']) == {
+        'solutions': 1, 'pattern': '+=', 'kind': 'add'
+    }
+    with pytest.raises(ValueError):
+        query_index([], colour=1)
+
+
+@pytest.mark.parametrize(
+    'cls, value, removed, added, expected',
+    [
+        (Digit, 8, 1, 0, {0, 6, 9}),
+        (Digit, 1, 0, 1, {7}),
+        (Digit, 2, 2, 2, {5}),
+        (Digit, 0, 1, 1, {6, 9}),
+        (Operator, '+', 1, 1, {'='}),
+        (Operator, '-', 0, 1, {'+', '='}),
+    ]
+)
+def test_token_moves(cls, value, removed, added, expected):
+    assert set(token_moves(cls, value)[removed, added]) == expected
+
+
+@pytest.mark.parametrize(
+    'expr', ['2 = 3', '1 + 7 = 8', '9 - 6 = 6', '0 - 4 = 7 + 1']
+)
+@pytest.mark.parametrize('m', [1, 2])
+def test_move_neighbourhoods_agree_with_move_matches(expr, m):
+    expected = {tuple(t.value for t in r) for r in move_matches(scan(expr), m)}
+    assert move_neighbourhoods(expr_values(expr), m)[m] == expected
+
+
+def test_move_graph_family():
+    graph3 = move_graph(3, 3)
+    graph1 = move_graph(3, 1)
+    assert graph1["2 + 1 = 3"] == {
+        " ".join(str(v) for v in values)
+        for values in move_neighbourhoods(
+            expr_values("2 + 1 = 3"), truth=False
+        )[1]
+    }
+    assert "2 + 1 = 3" in graph3
+    assert graph1 is move_graph(3, 1)
+
+
+def test_map_solutions33():
+    solutions = map_solutions(3, 3)
+    for riddle, riddle_solutions in list(solutions.items())[:20]:
+        assert set(solutions_of(riddle, 3)) == riddle_solutions
+
+
+@pytest.mark.parametrize(
+    'expr, expected',
+    [
+        ('1 + 7 = 8', (1, 0)),
+        ('9 - 6 = 6', (1, -3)),
+        ('2 = 3 - 1 + 5', (1, -5)),
+        ('1 + 2 - 3', (0, 0)),
+        ('1 = 1 = 1', (2, -1)),
+    ]
+)
+def test_evaluate(expr, expected):
+    assert evaluate(expr_values(expr)) == expected
+
+
+def test_coefficients():
+    assert coefficients(expr_values('1 - 2 = 3 - 4 + 5')) == \
+        (1, 0, -1, 0, -1, 0, 1, 0, -1)
+
+
+@pytest.mark.parametrize(
+    'expr', ['2 = 3', '1 + 7 = 8', '9 - 6 = 6', '0 - 4 = 7 + 1', '1 + 1 - 1']
+)
+@pytest.mark.parametrize('truth', [True, False])
+def test_move_neighbourhoods_truth(expr, truth):
+    """
+    Incremental evaluation agrees with evaluating expression strings
+    """
+    everything = move_neighbourhoods(expr_values(expr), 2)
+    selected = move_neighbourhoods(expr_values(expr), 2, truth=truth)
+    for m in (1, 2):
+        expected = {
+            values for values in everything[m]
+            if values.count('=') == 1
+            and is_trivial(" ".join(str(v) for v in values)) is truth
+        }
+        assert selected[m] == expected
+
+
+@pytest.mark.parametrize(
+    'expr, removed, added, expected',
+    [
+        ('6 + 7', 1, 0, {'5 + 7', '6 - 7', '6 + 1'}),
+        ('5 = 9', 0, 1, {'9 = 9', '6 = 9', '5 = 8'}),
+        ('8 = 8', 2, 1, {
+            '9 + 8', '8 + 0', '8 + 9', '0 + 8', '8 + 6', '6 + 8'
+        }),
+    ]
+)
+def test_neighbourhood(expr, removed, added, expected):
+    reached = neighbourhood(expr_values(expr), removed, added)
+    assert {expr_string(values) for values in reached} == expected
+
+
+@pytest.mark.parametrize(
+    'n, operators, expected',
+    [
+        (1, '+-', 0),
+        (3, '+', 110),
+        (4, '+-', 5340),
+        (5, '+-', 121880),
+    ]
+)
+def test_valid_equation_count_general(n, operators, expected):
+    assert len(valid_equations(n, operators)) == expected
+
+
+@pytest.mark.parametrize('operators', ['*', '+=', '+-/'])
+def test_valid_equations_unsupported_operators(operators):
+    with pytest.raises(ValueError):
+        valid_equations(3, operators)
+
+
+@pytest.mark.parametrize(
+    'eq',
+    [
+        '1 + 2 - 3 = 0 + 0',
+        '9 - 8 = 7 - 6 + 0',
+        '5 = 1 + 1 + 1 + 2',
+        '0 + 9 - 9 - 0 = 0',
+    ]
+)
+def test_valid_equations_5(eq):
+    assert eq in equation_list(5)
+
+
+def test_balanced_digits():
+    solutions = set(balanced_digits((1, -1, -1), 7))
+    assert solutions == {
+        (a, b, c) for a in range(10) for b in range(10) for c in range(10)
+        if 7 + a - b - c == 0
+    }
+
+
+@pytest.mark.parametrize(
+    'expr', ['0', '0 = 0', '2 = 3', '9 - 8 = 7 - 6 + 0']
+)
+def test_encode_decode(expr):
+    values = expr_values(expr)
+    assert decode(encode(values)) == values
+
+
+@pytest.mark.parametrize('n, m', [(2, 1), (3, 1), (3, 2)])
+def test_count_solutions(n, m):
+    expected = collections.Counter(
+        len(solutions) for solutions in map_solutions(n, m).values()
+    )
+    assert count_solutions(n, m) == expected
+
+
+def test_progress_report():
+    stream = io.StringIO()
+    with Progress(4, 'items', interval=0, stream=stream) as progress:
+        for _ in range(4):
+            progress.update()
+    lines = stream.getvalue().split('\r')
+    assert len(lines) == 6
+    assert lines[-1].startswith('items: 4/4 (100%)')
+    assert 'ETA 0:00' in lines[-1]
+    assert lines[-1].endswith('\n')
+
+
+def test_progress_disabled():
+    stream = io.StringIO()
+    with Progress(4, 'items', enabled=False, stream=stream) as progress:
+        progress.update(4)
+    assert stream.getvalue() == ''
+
+
+def test_zip_equalities_quiet(tmp_path, capsys):
+    zip_equalities(tmp_path / 'eqs.zip', ['1 = 1'], fmt='svg')
+    assert capsys.readouterr().out == f'-> {tmp_path / "eqs.zip"}\n'
+    zip_equalities(tmp_path / 'eqs.zip', ['1 = 1'], fmt='svg', verbose=True)
+    assert capsys.readouterr().out.startswith('1 = 1\n')
+
+
+@pytest.mark.parametrize('memory_budget', [1, 100, 10**6])
+def test_map_solutions_memory_budget(memory_budget):
+    assert map_solutions(3, 1, memory_budget=memory_budget) == \
+        map_solutions(3, 1)
+
+
+def test_spilled_solutions_in_riddle_order():
+    riddles = [riddle for riddle, _ in iter_spilled_solutions(3, 1, 50)]
+    assert riddles == sorted(riddles)
+
+
+def test_sharded_map_solutions(tmp_path):
+    tasks = init_shards(tmp_path, 3, 2, shards=4)
+    assert len(tasks) == 4
+    with pytest.raises(RuntimeError):
+        merge_shards(tmp_path)
+
+    claimed = claim_shard(tmp_path)
+    assert claimed.name == 'shard-0000.claimed'
+    claimed.rename(claimed.with_suffix('.task'))
+
+    assert work_shards(tmp_path) == 4
+    assert work_shards(tmp_path) == 0
+    assert merge_shards(tmp_path) == map_solutions(3, 2)
+
+
+def test_shards_reinit(tmp_path):
+    """
+    Results of an earlier build are not merged into a new one
+    """
+    init_shards(tmp_path, 3, 1, shards=2)
+    work_shards(tmp_path)
+    old = sorted(tmp_path.glob('shard-*.json'))
+    stale = {p: p.read_text() for p in old}
+    init_shards(tmp_path, 3, 2, shards=2)
+    assert not list(tmp_path.glob('shard-*.json'))
+    with pytest.raises(RuntimeError):
+        merge_shards(tmp_path)
+    for path, text in stale.items():
+        path.write_text(text)
+    with pytest.raises(RuntimeError):
+        merge_shards(tmp_path)
+    assert work_shards(tmp_path) == 2
+    assert merge_shards(tmp_path) == map_solutions(3, 2)
+
+
+def test_shards_init_keeps_other_files(tmp_path):
+    other = tmp_path / 'puzzle-index.json'
+    other.write_text('{}')
+    init_shards(tmp_path, 2, shards=2)
+    init_shards(tmp_path, 2, shards=2)
+    assert other.read_text() == '{}'
+    assert len(list(tmp_path.glob('shard-*.task'))) == 2
+
+
+def test_shards_stale_claim(tmp_path):
+    """
+    The claim of a worker that died is requeued once it is stale
+    """
+    import os
+
+    init_shards(tmp_path, 3, 1, shards=2)
+    claimed = claim_shard(tmp_path)
+    assert work_shards(tmp_path, stale_after=60) == 1
+    with pytest.raises(RuntimeError):
+        merge_shards(tmp_path)
+    assert requeue_stale_shards(tmp_path, 60) == []
+    os.utime(claimed, (0, 0))
+    assert work_shards(tmp_path, stale_after=60) == 1
+    assert not claimed.exists()
+    assert merge_shards(tmp_path) == map_solutions(3, 1)
+
+
+@pytest.mark.parametrize(
+    'expr, values',
+    [
+        ('1', (1,)),
+        (' 1 + 2 = 3 ', (1, '+', 2, '=', 3)),
+        ('9-8=1', (9, '-', 8, '=', 1)),
+    ]
+)
+def test_scan_values(expr, values):
+    assert scan_values(expr) == values
+
+
+@pytest.mark.parametrize('expr', ['1 * 2', '1 + x', '1 =\t1'])
+def test_scan_invalid(expr):
+    with pytest.raises(ValueError):
+        scan(expr)
+
+
+def test_scan_returns_fresh_tokens():
+    tokens = scan('1 = 1')
+    tokens[0].set_occupied(Digit.occupied[7])
+    assert scan('1 = 1') == [Digit(1), Operator('='), Digit(1)]
+
+
+def test_equation_tokens():
+    eq_id = equation_list(3).index('1 + 2 = 3')
+    assert equation_tokens(3, eq_id) == scan('1 + 2 = 3')
+
+
+def test_move_tables(tmp_path):
+    tables_file = tmp_path / 'digits.tables'
+    graphs = {n: move_graph(n, 1) for n in (2, 3)}
+    moves = {v: token_moves(Digit, v) for v in range(10)}
+    build_tables(tables_file, digits=(2, 3))
+    try:
+        tables = load_tables(tables_file)
+        assert tables.has_graph(3, 1)
+        assert not tables.has_graph(4, 1)
+        for n in (2, 3):
+            assert move_graph(n, 1) == graphs[n]
+        for v in range(10):
+            assert token_moves(Digit, v) == moves[v]
+        assert token_moves(Operator, '+') == {
+            (0, 0): ('+',), (1, 0): ('-',), (1, 1): ('=',)
+        }
+        assert map_solutions(3, 2)["9 - 6 = 6"] == {
+            "0 = 6 - 6", "9 - 9 = 0", "6 - 0 = 6", "3 + 6 = 9", "6 - 6 = 0",
+            "9 - 0 = 9", "8 - 2 = 6", "8 - 6 = 2", "3 + 5 = 8",
+        }
+    finally:
+        assert load_tables(tmp_path / 'missing.tables') is None
+
+
+@pytest.mark.parametrize(
+    'seq, expected',
+    [
+        ([Digit(5)], {(Digit(6),), (Digit(9),)}),
+        ([Digit(1), Operator('-')], {
+            (Digit(7), Operator('-')),
+            (Digit(1), Operator('+')),
+            (Digit(1), Operator('=')),
+        }),
+    ]
+)
+def test_add_matches_seq(seq, expected):
+    assert add_matches(seq, n=1) == expected
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 4])
+def test_remove_add_matches_inverse(n):
+    tokens = scan('8 + 9 = 8')
+    for removed in remove_matches(tokens, n):
+        assert tuple(tokens) in add_matches(list(removed), n)
+        assert sum(len(t) for t in removed) == sum(len(t) for t in tokens) - n
+
+
+def test_remove_matches_per_token():
+    """
+    Expression-level removals agree with Token.remove_matches
+    """
+    for value in range(10):
+        for n in (1, 2, 3):
+            assert remove_matches([Digit(value)], n) == {
+                (d,) for d in Digit(value).remove_matches(n)
+            }
+
+
+@pytest.mark.parametrize('kind', ['add', 'remove'])
+@pytest.mark.parametrize('m', [1, 2])
+def test_map_solutions_kinds(kind, m):
+    solutions = map_solutions(3, m, kind=kind)
+    assert solutions
+    for riddle, riddle_solutions in list(solutions.items())[:50]:
+        assert set(solutions_of(riddle, m, kind)) == riddle_solutions
+        for solution in riddle_solutions:
+            difference = (
+                sum(len(t) for t in scan(solution))
+                - sum(len(t) for t in scan(riddle))
+            )
+            assert difference == (m if kind == 'add' else -m)
+
+
+@pytest.mark.parametrize(
+    'n, m, kind',
+    [
+        (2, 1, 'move'),
+        (3, 1, 'move'),
+        (3, 2, 'move'),
+        (3, 1, 'add'),
+        (3, 1, 'remove'),
+    ]
+)
+def test_unique_puzzles(n, m, kind):
+    """
+    Unique puzzles are the riddles of the solution map with one solution
+    """
+    mapping = map_solutions(n, m, kind=kind)
+    assert unique_puzzles(n, m, kind=kind) == {
+        riddle: solutions
+        for riddle, solutions in mapping.items()
+        if len(solutions) == 1
+    }
+
+
+def test_segment_mask():
+    values = (8, '-', 1, '=', 7)
+    mask = segment_mask(values)
+    low = field_mask(values, 1)
+    counts = field_counts(mask, low)
+    assert [(counts >> 7*k) & 0b1111111 for k in range(5)] == [3, 1, 2, 0, 7]
+
+
+@pytest.mark.parametrize(
+    'n, riddle, score',
+    [
+        (3, '8 - 0 = 0', dict(solutions=1, crossing=1, operators=1)),
+        (2, '2 = 3', dict(solutions=2, crossing=0, operators=0)),
+        (2, '8 = 5', dict(solutions=2, crossing=2, operators=0)),
+    ]
+)
+def test_score_puzzles(n, riddle, score):
+    scores = score_puzzles(n, near=False)
+    assert {k: scores[riddle][k] for k in score} == score
+
+
+@pytest.mark.parametrize('kind', ['add', 'remove'])
+def test_score_puzzles_crossing_kinds(kind):
+    """
+    No match moves between tokens in add and remove puzzles
+    """
+    scores = score_puzzles(2, kind=kind)
+    assert scores
+    assert all(score['crossing'] is None for score in scores.values())
+
+
+def test_score_puzzles_near_misses():
+    """
+    Near misses are the solutions by one more or one less move
+    """
+    scores = score_puzzles(2, 1)
+    mapping = map_solutions(2, 2)
+    for riddle, score in scores.items():
+        assert score['near_misses'] == len(
+            mapping.get(riddle, set()) - map_solutions(2, 1)[riddle]
+        )
+
+
+def test_save_scores(tmp_path):
+    mapping = map_solutions(2)
+    score_file = tmp_path / 'scores.csv'
+    save_scores(score_puzzles(2, mapping=mapping), mapping, score_file)
+    lines = score_file.read_text().splitlines()
+    assert lines[0] == 'riddle,solutions,crossing,operators,near_misses,equations'
+    assert '3 = 8,1,1,0,2,9 = 9' in lines
+    assert len(lines) == len(mapping) + 1
+
+
+@pytest.fixture
+def glyph_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('MATCHSTICK_GLYPH_CACHE', str(tmp_path / 'glyphs'))
+    glyph.cache_clear()
+    glyph_boxes.cache_clear()
+    yield tmp_path / 'glyphs'
+    glyph.cache_clear()
+    glyph_boxes.cache_clear()
+
+
+def test_glyph_boxes(glyph_cache):
+    boxes = glyph_boxes()
+    assert (glyph_cache / 'boxes.json').exists()
+    assert len({(top, bottom) for _, top, _, bottom in boxes.values()}) == 1
+    assert boxes['1'][2] - boxes['1'][0] < boxes['8'][2] - boxes['8'][0]
+
+
+@pytest.mark.parametrize('height', [50, 120])
+def test_generate_image_height(glyph_cache, height):
+    img = generate_image('1 + 7 = 8', height)
+    assert img.size[1] == height
+    assert img.size[0] == sum(glyph(c, height).size[0] for c in '1+7=8')
+    assert (glyph_cache / str(height) / 'm7.png').exists()
+
+
+def test_glyph_cache_stale(glyph_cache):
+    glyph('7', 32)
+    cached = glyph_cache / '32' / 'm7.png'
+    os.utime(cached, (0, 0))
+    glyph.cache_clear()
+    glyph('7', 32)
+    assert cached.stat().st_mtime > 0
+
+
+def test_build_glyph_cache(glyph_cache):
+    build_glyph_cache([32])
+    assert len(list((glyph_cache / '32').glob('*.png'))) == 13
+
+
+def test_encode_image_height(glyph_cache):
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(encode_image('1 = 1', height=40)))
+    assert img.size[1] == 40
+
+
+def test_zip_solutions_update(tmp_path, capsys):
+    zip_file = tmp_path / 'puzzles.zip'
+    mapping = sorted(map_solutions(2).items())
+    zip_solutions(zip_file, mapping[:4], fmt='svg')
+    manifest = read_manifest(zip_file)
+    assert all(len(digest) == 40 for digest in manifest.values())
+
+    capsys.readouterr()
+    zip_solutions(zip_file, mapping, fmt='svg', update=True, verbose=True)
+    out = capsys.readouterr().out
+    updated = read_manifest(zip_file)
+    index = zip_file.stem + '/puzzles.idx'
+    assert updated[index] != manifest.pop(index)
+    assert {k: updated[k] for k in manifest} == manifest
+    written = [line for line in out.splitlines() if not line.startswith('->')]
+    # new images and links besides the index, and the summary line
+    assert len(written) == len(updated) - 1 - len(manifest) + 1
+
+    zip_solutions(zip_file, mapping, fmt='svg', update=True)
+    assert capsys.readouterr().out.startswith(
+        f'{zip_file}: 0 of {len(updated)} members written'
+    )
+
+
+def test_zip_solutions_update_glyphs(glyph_set, tmp_path):
+    """
+    Images are rendered again after the glyph set changed
+    """
+    zip_file = tmp_path / 'puzzles.zip'
+    mapping = sorted(map_solutions(2).items())
+    zip_solutions(zip_file, mapping, fmt='svg')
+    with zipfile.ZipFile(zip_file) as zp:
+        before = {info.filename: zp.read(info) for info in zp.infolist()}
+    glyph_set('untailed')
+    zip_solutions(zip_file, mapping, fmt='svg', update=True)
+    with zipfile.ZipFile(zip_file) as zp:
+        after = {info.filename: zp.read(info) for info in zp.infolist()}
+    changed = {name for name in before if before[name] != after[name]}
+    assert any('9' in name.rsplit('/', 1)[-1] for name in changed)
+
+
+def test_zip_solutions_update_glyphs_png(glyph_set, tmp_path):
+    """
+    Raster images are drawn from the glyph photographs, not the glyph
+    set, so they are kept
+    """
+    zip_file = tmp_path / 'puzzles.zip'
+    mapping = sorted(map_solutions(2).items())[:2]
+    zip_solutions(zip_file, mapping)
+    manifest = read_manifest(zip_file)
+    glyph_set('untailed')
+    zip_solutions(zip_file, mapping, update=True)
+    assert read_manifest(zip_file) == manifest
+
+
+def test_zip_solutions_update_stale(tmp_path):
+    """
+    Members gone or changed are dropped, the rest is kept as it was
+    """
+    zip_file = tmp_path / 'puzzles.zip'
+    mapping = sorted(map_solutions(2).items())
+    zip_solutions(zip_file, mapping, fmt='svg')
+    zip_solutions(zip_file, mapping[:4], fmt='svg', update=True)
+    fresh = tmp_path / 'fresh.zip'
+    zip_solutions(fresh, mapping[:4], fmt='svg', path='puzzles')
+    assert read_manifest(zip_file) == read_manifest(fresh)
+    with zipfile.ZipFile(zip_file) as zp, zipfile.ZipFile(fresh) as zf:
+        assert zp.testzip() is None
+        for info in zf.infolist():
+            assert zp.read(info.filename) == zf.read(info)
+
+    zip_solutions(zip_file, mapping[:4], fmt='svg', update=True, height=50)
+    assert read_manifest(zip_file).keys() == read_manifest(fresh).keys()
+    assert read_manifest(zip_file) != read_manifest(fresh)
+
+
+@pytest.fixture
+def glyph_set():
+    yield load_glyphs
+    load_glyphs('standard')
+
+
+def test_standard_glyph_set():
+    tables = compile_glyphs(read_glyph_set('standard'))
+    assert tables[Digit]['occupied'] == Digit.occupied
+    assert tables[Operator]['occupied'] == Operator.occupied
+    assert Digit.removals == {6: {5}, 7: {1}, 8: {0, 6, 9}, 9: {3, 5}}
+
+
+@pytest.mark.parametrize(
+    'name, value, occupied, removals',
+    [
+        ('untailed', 6, (1, 3, 4, 5, 6), set()),
+        ('untailed', 9, (0, 1, 2, 3, 5), {4}),
+        ('hooked-seven', 7, (0, 1, 2, 5), set()),
+    ]
+)
+def test_load_glyphs(glyph_set, name, value, occupied, removals):
+    glyph_set(name)
+    assert Digit.occupied[value] == occupied
+    assert Digit(value).get_occupied() == occupied
+    assert Digit.from_occupied(occupied).value == value
+    assert Digit.removals.get(value, set()) == removals
+
+
+def test_load_glyphs_solver(glyph_set):
+    """
+    The solver follows the glyph set: adding a match to 5 makes a tailed
+    9 but no tail-less one
+    """
+    assert list(solutions_of("5 = 9", kind='add')) == ["9 = 9"]
+    glyph_set('untailed')
+    assert list(solutions_of("5 = 9", kind='add')) == []
+    assert token_moves(Digit, 6)[1, 1] == (5,)
+    glyph_set('standard')
+    assert list(solutions_of("5 = 9", kind='add')) == ["9 = 9"]
+
+
+@pytest.mark.parametrize(
+    'spec',
+    [
+        {'digits': {'1': [2, 5], '7': [2, 5]}, 'operators': {}},
+        {'digits': {'1': [2, 7]}, 'operators': {}},
+        {'digits': {'x': [2, 5]}, 'operators': {}},
+        {'digits': {}, 'operators': {'*': [0, 1]}},
+    ]
+)
+def test_compile_glyphs_invalid(spec):
+    with pytest.raises(ValueError):
+        compile_glyphs(spec)
+
+
+def test_read_glyph_set_unknown(tmp_path):
+    glyph_file = tmp_path / 'glyphs.json'
+    glyph_file.write_text('{"a": {"base": "b"}, "b": {"base": "a"}}')
+    with pytest.raises(ValueError):
+        read_glyph_set('a', glyph_file)
+    with pytest.raises(ValueError):
+        read_glyph_set('c', glyph_file)
+
+
+def test_tables_of_other_glyph_set(glyph_set, tmp_path):
+    tables_file = tmp_path / 'digits.tables'
+    build_tables(tables_file, digits=(2,))
+    try:
+        assert load_tables(tables_file) is get_tables()
+        glyph_set('untailed')
+        assert get_tables() is None
+        glyph_set('standard')
+        assert get_tables() is not None
+    finally:
+        load_tables(tmp_path / 'missing.tables')
+
+
+def test_build_tables_default_path(tmp_path, monkeypatch):
+    """
+    Tables are rebuilt in place of the loaded ones, and an empty file
+    counts as no tables
+    """
+    tables_file = tmp_path / 'digits.tables'
+    monkeypatch.setenv('MATCHSTICK_TABLES', str(tables_file))
+    graph = move_graph(3, 1)
+    try:
+        build_tables(tables_file, digits=(2,))
+        assert load_tables().has_graph(2, 1)
+        build_tables(tables_file, digits=(2, 3))
+        assert load_tables().graph(3, 1) == graph
+        assert list(tmp_path.iterdir()) == [tables_file]
+        tables_file.write_bytes(b'')
+        assert load_tables() is None
+        assert move_graph(3, 1) == graph
+    finally:
+        load_tables(tmp_path / 'missing.tables')
+
+
+def test_shared_tables():
+    with SharedTables(equations=(3,)) as shared:
+        try:
+            tables = attach_tables(*shared.initargs)
+            assert tables.equations(3) == equation_values(3)
+            assert tables.token_moves(8) == token_moves(Digit, 8)
+            assert get_tables() is tables
+        finally:
+            load_tables(pathlib.Path('missing.tables'))
+            tables.close()
+
+
+@pytest.mark.parametrize('kind', ['move', 'add'])
+def test_parallel_map_solutions(kind):
+    assert parallel_map_solutions(3, 1, processes=2, kind=kind) == \
+        map_solutions(3, 1, kind=kind)
+
+
+def test_solve_riddles():
+    riddles = ["2 = 3", "1 + 7 = 8", "9 - 6 = 6"]
+    assert solve_riddles(riddles, processes=2) == {
+        riddle: set(solutions_of(riddle)) for riddle in riddles
+    }
+
+
+@pytest.mark.parametrize('fmt', ['svg', 'png'])
+def test_puzzle_archive(tmp_path, fmt):
+    zip_file = tmp_path / 'puzzles.zip'
+    mapping = map_solutions(2)
+    zip_solutions(zip_file, sorted(mapping.items()), fmt=fmt, mode='1')
+    with PuzzleArchive(zip_file) as archive, zipfile.ZipFile(zip_file) as zp:
+        for riddle, solutions in mapping.items():
+            assert archive.solutions(riddle) == sorted(solutions)
+            riddle_dir = f'puzzles/{len(solutions)}-solution-puzzles/' \
+                f'{riddle.replace(" ", "")}'
+            assert archive.riddle_image(riddle) == \
+                zp.read(f'{riddle_dir}/{img_filename(riddle, fmt)}')
+            assert archive.solution_images(riddle) == {
+                eq: zp.read(f'puzzles/equalities/{img_filename(eq, fmt)}')
+                for eq in solutions
+            }
+        with pytest.raises(KeyError):
+            archive.solutions('1 = 1')
+
+
+def test_puzzle_archive_update(tmp_path):
+    """
+    The index is rewritten in place of the old one on update
+    """
+    zip_file = tmp_path / 'puzzles.zip'
+    mapping = sorted(map_solutions(2).items())
+    zip_solutions(zip_file, mapping[:4], fmt='svg')
+    zip_solutions(zip_file, mapping, fmt='svg', update=True)
+    with zipfile.ZipFile(zip_file) as zp:
+        names = [info.filename for info in zp.infolist()]
+        assert zp.testzip() is None
+    assert names.count('puzzles/puzzles.idx') == 1
+    assert names[-1] == 'puzzles/puzzles.idx'
+    with PuzzleArchive(zip_file) as archive:
+        for riddle, solutions in mapping:
+            assert archive.solutions(riddle) == sorted(solutions)
+
+
+def test_puzzle_archive_without_index(tmp_path):
+    zip_equalities(tmp_path / 'eqs.zip', ['1 = 1'], fmt='svg')
+    with pytest.raises(ValueError):
+        PuzzleArchive(tmp_path / 'eqs.zip')
+
+
+@pytest.mark.parametrize(
+    'n, m, kind',
+    [
+        (2, 1, 'move'),
+        (3, 1, 'move'),
+        (3, 2, 'move'),
+        (3, 1, 'add'),
+        (3, 2, 'remove'),
+    ]
+)
+def test_iter_solutions(n, m, kind):
+    riddles = list(iter_solutions(n, m, kind=kind))
+    assert dict(riddles) == map_solutions(n, m, kind=kind)
+    assert len(riddles) == len(dict(riddles))
+    counts = [match_count(expr_values(riddle)) for riddle, _ in riddles]
+    assert counts == sorted(counts)
+
+
+def test_iter_solutions_streams(monkeypatch):
+    """
+    The first riddles are yielded before all equations are solved
+    """
+    import digits
+
+    solved = []
+
+    def neighbourhoods(values, *args, **kwargs):
+        solved.append(values)
+        return move_neighbourhoods(values, *args, **kwargs)
+
+    monkeypatch.setattr(digits, 'move_neighbourhoods', neighbourhoods)
+    riddles = iter_solutions(3, 1)
+    next(riddles)
+    assert 0 < len(solved) < len(equation_list(3))
+
+
+@pytest.mark.parametrize(
+    'm, kind',
+    [(1, 'move'), (2, 'move'), (1, 'add'), (2, 'remove')]
+)
+def test_move_descriptors(m, kind):
+    """
+    Moving the matches of the descriptors turns riddle into solution
+    """
+    removed, added = PUZZLE_KINDS[kind]
+    for riddle, solutions in map_solutions(3, m, kind=kind).items():
+        values = expr_values(riddle)
+        for solution in solutions:
+            descriptors = move_descriptors(values, expr_values(solution))
+            assert len(descriptors) == m
+            assert unpack_moves(pack_moves(descriptors)) == descriptors
+            sources, destinations = descriptor_sites(descriptors)
+            assert len(sources) == m * added
+            assert len(destinations) == m * removed
+            occupied = {
+                (i, seg)
+                for i, t in enumerate(scan(riddle))
+                for seg in t.get_occupied()
+            }
+            assert occupied >= set(sources)
+            assert not occupied & set(destinations)
+            moved = (occupied - set(sources)) | set(destinations)
+            assert moved == {
+                (i, seg)
+                for i, t in enumerate(scan(solution))
+                for seg in t.get_occupied()
+            }
+
+
+def test_move_descriptors_pile():
+    assert move_descriptors((9, '=', 3), (8, '=', 3)) == (NO_SITE << 8 | 4,)
+    assert descriptor_sites(move_descriptors((8, '=', 3), (9, '=', 3))) == \
+        ([(0, 4)], [])
+
+
+def test_iter_solutions_moves():
+    for riddle, solutions in iter_solutions(2, 1, moves=True):
+        assert {
+            eq: unpack_moves(packed) for eq, packed in solutions.items()
+        } == {
+            eq: move_descriptors(expr_values(riddle), expr_values(eq))
+            for eq in map_solutions(2, 1)[riddle]
+        }
+
+
+def test_puzzle_archive_moves(tmp_path):
+    zip_file = tmp_path / 'puzzles.zip'
+    mapping = map_solutions(3)
+    zip_solutions(zip_file, sorted(mapping.items()), fmt='svg')
+    with PuzzleArchive(zip_file) as archive:
+        moves = archive.moves('8 - 0 = 0')
+    assert moves == {'0 + 0 = 0': (3 << 8 | 7,)}
+    sources, destinations = descriptor_sites(moves['0 + 0 = 0'])
+    svg = generate_svg('0 + 0 = 0', highlight=destinations, vacated=sources)
+    assert svg.count('stroke="red"') == 1
+    assert svg.count('stroke-dasharray') == 1
+
+
+def test_puzzle_archive_many_moves(tmp_path):
+    """
+    Records of puzzles of five moves and more do not fit a packed int
+    """
+    zip_file = tmp_path / 'puzzles.zip'
+    mapping = sorted(map_solutions(3, 5).items())[:3]
+    zip_solutions(zip_file, mapping, fmt='svg')
+    with PuzzleArchive(zip_file) as archive:
+        for riddle, solutions in mapping:
+            moves = archive.moves(riddle)
+            assert sorted(moves) == archive.solutions(riddle)
+            assert set(moves) == set(solutions)
+            for solution, descriptors in moves.items():
+                assert descriptors == move_descriptors(
+                    expr_values(riddle), expr_values(solution)
+                )
+    assert any(
+        len(move_descriptors(expr_values(riddle), expr_values(solution))) >= 5
+        for riddle, solutions in mapping for solution in solutions
+    )
@@ -1,4 +1,6 @@
 import pytest
+
+import digits
 from matches import Digit
 
 
@@ -90,3 +92,17 @@ from matches import Digit
 )
 def test_digit(n, digit):
     assert str(Digit(n)) == digit
+
+
+def test_digit_glyph_set():
+    digits.load_glyphs('untailed')
+    try:
+        assert str(Digit(6)) == """
+ ──
+┃  │
+ ━━
+┃  ┃
+ ━━
+"""
+    finally:
+        digits.load_glyphs('standard')